@@ -24,9 +24,13 @@ def cmd_price_quote():
     r = requests.get(url)
     print(r.text)
 
-def cmd_buy(action):
-    url = SERVER_URL + 'buy?action=%s&payout_address=%s' % \
-                        (action, wallet.get_payout_address())
+def cmd_buy(action, quantity=1):
+    # lock a price first; /buy charges exactly that
+    r = requests.get(SERVER_URL + 'quote/lock?action=%s&quantity=%d' %
+                     (action, quantity))
+    lock = r.json()
+    url = SERVER_URL + 'buy?action=%s&quantity=%d&payout_address=%s&lock=%s' % \
+                        (action, quantity, wallet.get_payout_address(), lock['lock'])
     r = requests.get(url)
     print(r.text)
 
@@ -0,0 +1,142 @@
+"""  Database schema/connection manager
+
+Connections run in WAL mode so quotes keep reading while an order is
+being committed, with synchronous=NORMAL (no fsync per commit; a power
+loss can drop the last commits but never corrupts the database; paid
+orders are committed with synchronous=FULL) and a larger page cache. All
+queries are parameterized so their prepared statements are reused from
+each connection's cache. The Flask servers borrow one connection per
+request from a ConnectionPool and hand it back when the app context
+tears down.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from flask import current_app, g
+
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book.schema')
+
+POOL_SIZE = 16
+BUSY_TIMEOUT = 5.0  # seconds to wait on a locked database
+CACHE_SIZE = -16384  # page cache per connection, in KiB when negative
+STATEMENT_CACHE = 256  # prepared statements kept per connection
+
+def connect(database):
+    conn = sqlite3.connect(database, timeout=BUSY_TIMEOUT,
+                           check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=%d" % CACHE_SIZE)
+    return conn
+
+def migrate(conn):
+    """ bring a book database up to the current schema
+        safe to run on every start
+    """
+    rebuild_orders(conn)
+    add_payout_state(conn)
+    with open(SCHEMA, 'r') as f:
+        conn.executescript(f.read())
+    conn.commit()
+
+def rebuild_orders(conn):
+    """ recreate an orders table from before AUTOINCREMENT, keeping its
+        rows; the schema then recreates the indexes
+    """
+    row = conn.execute("SELECT sql FROM sqlite_master \
+        WHERE type = 'table' AND name = 'orders'").fetchone()
+    if row is None or 'AUTOINCREMENT' in row[0].upper():
+        return
+    with conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        conn.execute("ALTER TABLE orders RENAME TO orders_legacy")
+        for (name,) in conn.execute("SELECT name FROM sqlite_master \
+                WHERE type = 'index' AND tbl_name = 'orders_legacy' \
+                AND sql IS NOT NULL").fetchall():
+            conn.execute("DROP INDEX %s" % name)
+        conn.execute(row[0].replace('INTEGER PRIMARY KEY',
+                                    'INTEGER PRIMARY KEY AUTOINCREMENT', 1))
+        conn.execute("INSERT INTO orders SELECT * FROM orders_legacy")
+        conn.execute("DROP TABLE orders_legacy")
+
+def add_payout_state(conn):
+    """ add settle_rate and payout_id to an older orders_archive; its
+        rows were settled by then, so none is left owed
+    """
+    columns = [r[1] for r in conn.execute("PRAGMA table_info(orders_archive)")]
+    if not columns or 'payout_id' in columns:
+        return
+    with conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        conn.execute("ALTER TABLE orders_archive ADD COLUMN settle_rate REAL")
+        conn.execute("ALTER TABLE orders_archive ADD COLUMN payout_id INTEGER")
+        conn.execute("UPDATE orders_archive SET payout_id = 0")
+
+class ConnectionPool(object):
+    """ connections to one database, each lent to one thread at a time
+    """
+
+    def __init__(self, database, size=POOL_SIZE):
+        self.database = database
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return connect(self.database)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self.idle.put(conn)
+        self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+def init_app(app, database):
+    """ lend each request a pooled connection, returned on teardown
+    """
+    pool = ConnectionPool(database)
+    app.extensions['book_db'] = pool
+
+    @app.teardown_appcontext
+    def release_db(exception):
+        conn = g.pop('_database', None)
+        if conn is not None:
+            pool.release(conn)
+
+    return pool
+
+def get_db():
+    conn = getattr(g, '_database', None)
+    if conn is None:
+        conn = g._database = current_app.extensions['book_db'].acquire()
+    return conn
@@ -1,72 +1,175 @@
 import yaml
 
-import json
-import requests
+import atexit
+import os
+import threading
 
-from two1.lib.wallet import Wallet
-from two1.lib.bitserv.flask import Payment
+# VENDING_OFFLINE=1 swaps the 21 wallet, payments and the live BTCUSD
+# feeds for the stand-ins, for running without a 21 computer or network
+OFFLINE = os.environ.get('VENDING_OFFLINE') == '1'
+
+if OFFLINE:
+    from standin import Wallet, Payment, StaticPriceSource
+else:
+    from two1.lib.wallet import Wallet
+    from two1.lib.bitserv.flask import Payment
 
 # import flask web microframework
 from flask import Flask
+from flask import request
 
-import atexit
-import threading
-from datetime import datetime, timedelta
-
-from payout import execute_payout, execute_mock
+import db
+from orderbook import live_book, order_writer, expires_at
+from payout import execute_payout, sweep_balances
+from scheduler import ExpiryScheduler
+from price_feed import PriceFeed
+from price_oracle import PriceOracle, PriceSource, PriceUnavailable
+from price_lock import PriceLock, LockInvalid
+from quote_stream import QuoteBroadcaster
 
 PaymentLock = threading.Lock()
-PaymentThread = threading.Thread()
 
-# remove for dev env
+# only the paying server (server.py) hands this to vending_machine; the
+# dev and async servers take no payment and settle without a wallet
 wallet = Wallet()
-# wallet = None
 
 PAYMENT_REQ = 10000
+MAX_QUANTITY = 100  # options per /buy
 CURR_PRICE = 'https://api.coindesk.com/v1/bpi/currentprice.json'
-
-# fetch current bitcoin price
+# (name, url, path to the rate in the JSON response)
+PRICE_SOURCES = [
+    ('coindesk', CURR_PRICE, ['bpi', 'USD', 'rate_float']),
+    ('bitstamp', 'https://www.bitstamp.net/api/v2/ticker/btcusd/', ['last']),
+    ('coinbase', 'https://api.coinbase.com/v2/prices/BTC-USD/spot',
+        ['data', 'amount']),
+]
+PRICE_DEADLINE = 2.0  # seconds to wait for the sources on each refresh
+PRICE_INTERVAL = 10  # seconds between background refreshes
+PRICE_MAX_AGE = 60  # never quote off a rate older than this
+SETTLE_WINDOW = 5  # seconds of expiries settled together
+
+OFFLINE_RATE = 400.0  # BTCUSD quoted offline, give or take OFFLINE_JITTER
+OFFLINE_JITTER = 1.0
+
+if OFFLINE:
+    price_oracle = StaticPriceSource(OFFLINE_RATE, OFFLINE_JITTER)
+else:
+    price_oracle = PriceOracle([PriceSource(*s) for s in PRICE_SOURCES],
+                               PRICE_DEADLINE)
+price_feed = PriceFeed(price_oracle, PRICE_INTERVAL, PRICE_MAX_AGE)
+# HMAC key for price locks; without one set, outstanding locks die with
+# the process
+LOCK_SECRET = os.environ.get('VENDING_LOCK_SECRET', '').encode('utf-8') \
+    or os.urandom(32)
+price_lock = PriceLock(LOCK_SECRET)
+
+# current bitcoin price, served from the feed's cache
 def get_quote():
-    q = requests.get(CURR_PRICE)
-    if q.content:
-        quote = json.loads(q.content.decode('utf-8'))
-        usd = quote.get('bpi').get('USD')
-        return usd.get('rate_float')
-
-def vending_machine():
+    return price_feed.get()
+
+# pushes each new quote to every /quote/stream client
+quote_broadcaster = QuoteBroadcaster(get_quote)
+
+# price of `quantity` options off the current book, as a fill struck at
+# BTCUSD now would pay, locked for the client
+def lock_quote(is_buy, quantity=1):
+    usd_rate = get_quote()
+    price = int(round(live_book.get_quote(is_buy, usd_rate,
+                                          quantity=quantity) * PAYMENT_REQ))
+    return price, usd_rate, price_lock.issue(is_buy, price, usd_rate,
+                                             quantity=quantity)
+
+# what /buy charges: the price in the request's lock, if it is unused and
+# BTCUSD has not moved away from it
+def locked_price(*args, **kwargs):
+    is_buy = request.args.get('action') == 'up'
+    try:
+        quantity = quantity_arg(request.args)
+    except ValueError as e:
+        raise LockInvalid(str(e))
+    price, usd_rate = price_lock.verify(request.args.get('lock'), is_buy,
+                                        quantity=quantity,
+                                        usd_rate=get_quote())
+    return price
+
+# options per order, from the query string
+def quantity_arg(args):
+    quantity = int(args.get('quantity', 1))
+    if not 1 <= quantity <= MAX_QUANTITY:
+        raise ValueError("quantity must be 1 to %d" % MAX_QUANTITY)
+    return quantity
+
+# /show query string: after_id and limit page by order id, side is up/down
+def page_args(args):
+    after_id = int(args.get('after_id', 0))
+    limit = int(args.get('limit', -1))
+    side = args.get('side')
+    if side not in (None, 'up', 'down'):
+        raise ValueError("side must be up or down")
+    return after_id, limit, None if side is None else int(side == 'up')
+
+def vending_machine(database, wallet=None):
     app = Flask(__name__)
 
-    def interrupt():
-        global PaymentThread
-        #PaymentThread.cancel()
+    @app.errorhandler(PriceUnavailable)
+    def price_unavailable(e):
+        return "BTCUSD price unavailable, try again later", 503
 
-    def doPayment():
-        global wallet
-        global PAYMENT_REQ
-        global get_quote
-        global PaymentThread
+    @app.errorhandler(LockInvalid)
+    def lock_invalid(e):
+        return "%s, get a new one from /quote/lock" % e, 400
 
-        usd_rate = get_quote()
+    # stops the machine's threads, for tests; they also stop at exit
+    app.extensions['vending_machine'] = start_machine(database, wallet)
+    return app
 
-        with PaymentLock:
-            PaymentLock.acquire()
-            #next_date = execute_payout(conn, wallet, usd_rate, PAYMENT_REQ)
-            #next_date = execute_mock(conn, wallet, usd_rate, PAYMENT_REQ)
-            Paymentlock.release()
+def start_machine(database, wallet=None):
+    """ price feed, expiry settlement and the order writer, for any
+        server in front of `database`; expired orders are settled and
+        winners paid from `wallet`. Without a wallet nothing is settled:
+        the book is left for the paying server sharing the database, as
+        a claim made here would archive its winners as owed nothing.
+        returns the function that stops them
+    """
+    def interrupt():
+        order_writer.stop()
+        expiry_scheduler.stop()
+        quote_broadcaster.stop()
+        price_feed.stop()
 
-        # Set the next event to happen
-        wait = datetime.now() + timedelta(hours=24) - next_date
-        PaymentThread = threading.Timer(wait.total_seconds(), doPayment)
-        PaymentThread.start()   
+    def doPayment(until):
+        usd_rate = get_quote()
+        # the scheduler thread settles on its own connection
+        conn = db.connect(database)
+        try:
+            with PaymentLock:
+                execute_payout(conn, wallet, usd_rate, PAYMENT_REQ,
+                               until=until)
+                # change owed from /buy, once it is worth sending
+                sweep_balances(conn, wallet, usd_rate)
+        finally:
+            conn.close()
 
     def doPaymentStart():
-        global PaymentThread
-        wait = timedelta(hours=24)
-        PaymentThread = threading.Timer(wait.total_seconds(), doPayment)
-        PaymentThread.start()
+        conn = db.connect(database)
+        try:
+            db.migrate(conn)
+            if wallet is None:
+                return
+            expiry_scheduler.load(conn)
+        finally:
+            conn.close()
+        live_book.listeners.append(
+            lambda order: expiry_scheduler.add(expires_at(order.created_at)))
+        expiry_scheduler.start()
+
+    expiry_scheduler = ExpiryScheduler(doPayment, SETTLE_WINDOW)
 
     # Initiate
-    # doPaymentStart()
+    price_feed.start()
+    doPaymentStart()
+    order_writer.start(lambda: db.connect(database))
+    quote_broadcaster.start()
     # clear the trigger for the next thread
     atexit.register(interrupt)
-    return app
+    return interrupt
@@ -0,0 +1,45 @@
+"""  App manifest cache
+
+The 21 crawler polls /manifest over and over. The YAML is parsed once
+with safe_load and kept as ready-to-send JSON bytes. Each request only
+stats the file, and the manifest is parsed again when its mtime changes.
+The ETag is a hash of the JSON, and Last-Modified is the file's mtime.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+import yaml
+
+MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'manifest.yaml')
+
+class Manifest(object):
+
+    def __init__(self, path=MANIFEST):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.body = None  # JSON bytes
+        self.etag = None
+        self.last_modified = None  # aware UTC datetime
+
+    def get(self):
+        """ (body, etag, last_modified), parsed again if the file changed
+        """
+        mtime = os.stat(self.path).st_mtime_ns
+        with self.lock:
+            if mtime != self.mtime:
+                self._load(mtime)
+            return self.body, self.etag, self.last_modified
+
+    def _load(self, mtime):
+        with open(self.path, 'r') as f:
+            doc = yaml.safe_load(f)
+        self.body = json.dumps(doc).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self.last_modified = datetime.fromtimestamp(mtime // 10**9,
+                                                    timezone.utc)
+        self.mtime = mtime
@@ -1,10 +1,11 @@
 #!/bin/sh
 
-FN=book.sqlite3
+FN=${1:-book.sqlite3}
 
 if [ -f $FN ]
 then
-    echo Database $FN already exists.  Will not overwrite
-    exit 1
+    echo Database $FN already exists.  Applying migrations
 fi
-sqlite3 $FN < book.schema
+# db.migrate rather than sqlite3 < book.schema: older orders tables are
+# rebuilt with AUTOINCREMENT first
+python3 -c "import db, sys; db.migrate(db.connect(sys.argv[1]))" $FN
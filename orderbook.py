@@ -1,51 +1,747 @@
 """  OrderBook/db manager
 """
 
+import calendar
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta
 
-from price_rules import calc_cost
+try:
+    import numpy as np
+except ImportError:  # ColumnarOrderBook falls back to a Python loop
+    np = None
 
-def add_to_book(conn, address, payment, usd_rate, is_buy=True):
-    # fetch book
-    book = get_order_book(conn, usd_rate)
-    cost = book.get_quote(is_buy)
+from price_rules import calc_cost, calc_cost_many, time_weighted_q, \
+    EXPIRY_SECONDS
 
-    adj_payment = int(round(cost*payment))
-    order = Order(is_buy, address, usd_rate, adj_payment)
-    add_order_book(conn, order)
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # as stored by CURRENT_TIMESTAMP, UTC
+STRIKE_BUCKET = 10  # USD width of a strike bucket in the book summary
+HOUR = 3600
+QUOTE_TICK = 1  # seconds a cached quote is good for
+STRIKE_KEY_BITS = 40  # StrikeSums spans strikes up to 2**40 cents
+
+class WriterStopped(Exception):
+    pass
+
+def add_to_book(conn, address, payment, usd_rate, is_buy=True, price=None,
+                quantity=1):
+    # price off the resident book instead of rebuilding it; the fill is
+    # placed in the book as it is priced, so the next buyer pays for it.
+    # A price locked in advance is taken as is. `payment` is per option.
+    live_book.ensure_loaded(conn)
+    orders = live_book.fill_many(is_buy, address, usd_rate, payment,
+                                 quantity, price=price)
+    change = payment*quantity - sum(o.price for o in orders)
+    try:
+        write_orders(conn, orders)
+    except Exception:
+        live_book.remove(orders)
+        raise
 
-    change = payment - adj_payment
     return change
 
 def get_book_quote(conn, usd_rate):
-    book = get_order_book(conn,usd_rate=None)
-    buy_cost = book.get_quote(True)
-    sell_cost = book.get_quote(False)
+    live_book.ensure_loaded(conn)
+    buy_cost = live_book.get_quote(True)
+    sell_cost = live_book.get_quote(False)
     return buy_cost, sell_cost
 
+class QuoteCache(object):
+    """ Rendered /quote, kept until the book changes, the BTCUSD rate
+        moves or the next `tick` of seconds starts (the time weighting
+        drifts the quote even when nothing trades); one per quantity
+    """
+
+    def __init__(self, render, book=None, tick=QUOTE_TICK):
+        self.render = render  # render(usd_rate, buy_cost, sell_cost)
+        self.book = book
+        self.tick = tick
+        self.entries = {}  # quantity -> (key, rendered quote)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, usd_rate, now=None, quantity=1):
+        """ the book must already be loaded
+        """
+        if now is None:
+            now = time.time()
+        book = self.book or live_book
+        key = (book.version, usd_rate, int(now // self.tick))
+        entry = self.entries.get(quantity)
+        if entry is not None and entry[0] == key:
+            with self.lock:
+                self.hits += 1
+            return entry[1]
+        with self.lock:
+            self.misses += 1
+        quote = self.render(usd_rate,
+                            book.get_quote(True, None, now, quantity),
+                            book.get_quote(False, None, now, quantity))
+        self.entries[quantity] = (key, quote)
+        return quote
+
+    def stats(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {"hits": hits, "misses": misses,
+                "hit_rate": float(hits) / total if total else 0.0}
+
+# fixed statement text, so sqlite3's statement cache serves every call
+SELECT_BOOK = "SELECT is_buy, payout_address, usd_rate, price, created_at \
+                    FROM orders WHERE is_buy >= 0 ORDER BY created_at"
+SELECT_STRIKE_BOOK = "SELECT is_buy, payout_address, usd_rate, price, \
+                    created_at FROM orders \
+                    WHERE (is_buy = 0 AND usd_rate <= :usd_rate) OR \
+                    (is_buy = 1 AND usd_rate >= :usd_rate) \
+                    ORDER BY created_at"
+
+SELECT_BOOK_COLUMNS = "SELECT is_buy, payout_address, usd_rate, price, \
+                    CAST(strftime('%s', created_at) AS INTEGER) \
+                    FROM orders WHERE is_buy >= 0 ORDER BY created_at"
+
 def get_order_book(conn, usd_rate=None):
     c = conn.cursor()
     orders = []
     if usd_rate:
-        query = "SELECT is_buy, payout_address, usd_rate, price FROM orders \
-                    WHERE (is_buy = 0 AND usd_rate <= %.5f) OR \
-                    (is_buy = 1 AND usd_rate >= %.5f) \
-                    ORDER BY created_at" % (usd_rate, usd_rate)
+        rows = c.execute(SELECT_STRIKE_BOOK, {"usd_rate": usd_rate})
     else:
-        query = "SELECT is_buy, payout_address, usd_rate, price FROM orders \
-                    WHERE is_buy >= 0 ORDER BY created_at"
-    for is_buy, address, usd_rate, price in c.execute(query):
-        orders.append(Order(is_buy, address, usd_rate, price))
+        rows = c.execute(SELECT_BOOK)
+    for is_buy, address, usd_rate, price, created_at in rows:
+        orders.append(Order(is_buy, address, usd_rate, price,
+                            parse_time(created_at)))
     return OrderBook(orders)
 
+INSERT_ORDER = "INSERT INTO orders(is_buy, payout_address, usd_rate, price, \
+                    created_at) values(:is_buy, :payout_address, :usd_rate, \
+                    :price, :created_at)"
+
+CREDIT_CHANGE = "INSERT INTO balances(payout_address, amount) \
+                    values(:payout_address, :change) \
+                    ON CONFLICT(payout_address) DO UPDATE \
+                    SET amount = amount + excluded.amount, \
+                    updated_at = CURRENT_TIMESTAMP"
+
+SELECT_PAGE = "SELECT id, is_buy, payout_address, usd_rate, price, \
+                    created_at FROM orders WHERE id > :after_id \
+                    ORDER BY id LIMIT :limit"
+SELECT_SIDE_PAGE = "SELECT id, is_buy, payout_address, usd_rate, price, \
+                    created_at FROM orders WHERE id > :after_id \
+                    AND is_buy = :is_buy ORDER BY id LIMIT :limit"
+
+def iter_orders(conn, after_id=0, limit=-1, is_buy=None):
+    """ open orders with id > after_id in id order, straight off the
+        cursor; limit -1 means all, is_buy None means both sides
+    """
+    params = {"after_id": after_id, "limit": limit, "is_buy": is_buy}
+    query = SELECT_PAGE if is_buy is None else SELECT_SIDE_PAGE
+    for order_id, is_buy, address, usd_rate, price, created_at in \
+            conn.execute(query, params):
+        yield Order(is_buy, address, usd_rate, price, parse_time(created_at),
+                    order_id)
+
+def dump_stream(orders):
+    """ orders as a JSON array, one chunk per order
+    """
+    yield '['
+    sep = ''
+    for o in orders:
+        yield sep + json.dumps(o.to_json())
+        sep = ','
+    yield ']'
+
+def get_columnar_book(conn):
+    book = ColumnarOrderBook()
+    for row in conn.execute(SELECT_BOOK_COLUMNS):
+        book.append(*row)
+    return book
+
 def add_order_book(conn, order):
-    c = conn.cursor()
-    insert = "INSERT INTO orders(is_buy, payout_address, usd_rate, price) \
-                    values(:is_buy, :payout_address, :usd_rate, :price)"
-    c.execute(insert, {"is_buy": order.is_buy, 
-                        "payout_address": order.payout_address,
-                        "usd_rate": order.usd_rate,
-                        "price": order.price})
+    write_order(conn, order)
+    live_book.add(order)
+
+def write_order(conn, order, change=0):
+    """ insert the order, crediting `change` to its payout address
+    """
+    write_orders(conn, [order], change)
+
+def write_orders(conn, orders, change=0):
+    """ insert one purchase's orders in one transaction, crediting
+        `change` to their payout address
+    """
+    for order in orders:
+        if order.created_at is None:
+            order.created_at = datetime.utcnow().replace(microsecond=0)
+    if order_writer.running:
+        try:
+            # returns once the writer has committed the orders
+            order_writer.submit_all(orders, change)
+            return
+        except WriterStopped:
+            pass  # stopped before committing them: commit them here
+    # commit straight away: the write lock is held for one insert only.
+    # The pool runs synchronous=NORMAL; paid orders get the writer's fsync
+    sync = conn.execute("PRAGMA synchronous").fetchone()[0]
+    conn.execute("PRAGMA synchronous=FULL")
+    try:
+        with conn:
+            insert_orders(conn, [PendingOrder(orders, change)])
+    finally:
+        conn.execute("PRAGMA synchronous=%d" % sync)
+
+def insert_orders(conn, pending):
+    conn.executemany(INSERT_ORDER,
+                     [o.to_row() for p in pending for o in p.orders])
+    credits = [{"payout_address": p.orders[0].payout_address,
+                "change": p.change} for p in pending if p.change]
+    if credits:
+        conn.executemany(CREDIT_CHANGE, credits)
+
+def split_price(price, quantity):
+    """ `price` spread over `quantity` options, summing back to it
+    """
+    base, extra = divmod(price, quantity)
+    return [base + 1] * extra + [base] * (quantity - extra)
+
+def parse_time(created_at):
+    return datetime.fromisoformat(created_at[:19])
+
+def strike_key(usd_rate):
+    # 1-based Fenwick index of the strike's cent; in the same order as
+    # the strikes, ties within a cent aside
+    return min(int(usd_rate * 100) + 1, (1 << STRIKE_KEY_BITS) - 1)
+
+class StrikeSums(object):
+    """ Sum of the expiry times of one side's orders by strike, as a
+        sparse Fenwick tree over strike_key: adding an order and summing
+        every order struck in or below a given cent are each
+        STRIKE_KEY_BITS dict lookups at most, whatever the size of the book
+    """
+
+    def __init__(self):
+        self.tree = {}  # node -> sum of the expiries under it; no zeros
+
+    def add(self, key, expiry):
+        # a negative expiry takes an order back out
+        tree = self.tree
+        i = key
+        while i < 1 << STRIKE_KEY_BITS:
+            total = tree.get(i, 0) + expiry
+            if total:
+                tree[i] = total
+            else:
+                del tree[i]
+            i += i & -i
+
+    def upto(self, key):
+        """ sum over the strikes with strike_key at most `key`
+        """
+        tree = self.tree
+        total = 0
+        while key > 0:
+            total += tree.get(key, 0)
+            key &= key - 1
+        return total
+
+class LiveBook(object):
+    """ Process-resident view of the open orders
+
+        Loaded once from the orders table and then kept current by fills,
+        add_order_book and expiry in payout.execute_orders. Per side it
+        keeps the strikes in sorted order, their expiry times alongside,
+        and the sum of those expiry times, so the time-weighted q of a
+        side is O(1). The expiry times are also summed by strike in a
+        StrikeSums, so the strike-filtered one is a bisect and a prefix
+        sum, O(log n) but for the orders struck within the same cent as
+        the strike, which are summed one by one.
+        Orders past expiry stay until settlement claims them but weigh
+        nothing: the expiry times are also kept sorted on their own, with
+        their strikes, so the expired ones are a (short) prefix to take
+        back out of the count and the sum.
+
+        It also keeps the count and notional (price paid) of the open
+        orders per (side, strike bucket, expiry hour), updated on every
+        insert and expiry, for the book summary. `version` counts the
+        changes to the book.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.listeners = []  # called with each order added
+        self.version = 0
+        self._summary = None  # (version, hour, etag, body)
+        self._reset()
+
+    def _reset(self):
+        # keyed by is_buy
+        self.rates = {1: [], 0: []}  # sorted strikes
+        self.expiries = {1: [], 0: []}  # epoch expiry, same order as rates
+        self.prices = {1: [], 0: []}  # price paid, same order as rates
+        self.expiry_sums = {1: 0, 0: 0}
+        self.strike_sums = {1: StrikeSums(), 0: StrikeSums()}
+        self.by_expiry = {1: [], 0: []}  # the expiries, sorted
+        self.by_expiry_rates = {1: [], 0: []}  # strikes, same order
+        # (is_buy, strike bucket, expiry hour) -> [count, notional]
+        self.buckets = {}
+
+    def load(self, conn):
+        c = conn.cursor()
+        with self.lock:
+            self._reset()
+            for is_buy, usd_rate, price, created in c.execute("SELECT \
+                    is_buy, usd_rate, price, \
+                    CAST(strftime('%s', created_at) AS INTEGER) \
+                    FROM orders WHERE is_buy >= 0 \
+                    ORDER BY usd_rate, created_at"):
+                expiry = created + EXPIRY_SECONDS
+                self.rates[is_buy].append(usd_rate)
+                self.expiries[is_buy].append(expiry)
+                self.prices[is_buy].append(price or 0)
+                self._tally(is_buy, usd_rate, expiry, price or 0, 1)
+            for side in (1, 0):
+                self.expiry_sums[side] = sum(self.expiries[side])
+                sums = {}
+                for r, e in zip(self.rates[side], self.expiries[side]):
+                    key = strike_key(r)
+                    sums[key] = sums.get(key, 0) + e
+                strike_sums = self.strike_sums[side]
+                for key, total in sums.items():
+                    strike_sums.add(key, total)
+                pairs = sorted(zip(self.expiries[side], self.rates[side]))
+                self.by_expiry[side] = [e for e, _ in pairs]
+                self.by_expiry_rates[side] = [r for _, r in pairs]
+            self.version += 1
+            self.loaded = True
+
+    def ensure_loaded(self, conn):
+        if not self.loaded:
+            self.load(conn)
+
+    def add(self, order):
+        if not self.loaded:
+            return
+        with self.lock:
+            self._insert(order)
+        self._notify(order)
+
+    def fill(self, is_buy, address, usd_rate, payment, now=None,
+             price=None):
+        """ price a new order and place it in the book in one step, so
+            every fill is priced after all the fills before it; a given
+            price (from a price lock) is used instead of the quote
+        """
+        return self.fill_many(is_buy, address, usd_rate, payment, 1, now,
+                              price)[0]
+
+    def fill_many(self, is_buy, address, usd_rate, payment, quantity,
+                  now=None, price=None):
+        """ fill `quantity` options as one order, priced as that many
+            single fills in a row; price, if given, is the total. The
+            total is spread over the options, one row each.
+        """
+        if now is None:
+            now = time.time()
+        created_at = datetime.utcfromtimestamp(int(now))
+        with self.lock:
+            if price is None:
+                price = int(round(
+                    self._quote(is_buy, usd_rate, now, quantity)*payment))
+            orders = [Order(is_buy, address, usd_rate, p, created_at)
+                      for p in split_price(price, quantity)]
+            for order in orders:
+                self._insert(order)
+        for order in orders:
+            self._notify(order)
+        return orders
+
+    def remove(self, orders):
+        if not self.loaded:
+            return
+        with self.lock:
+            for o in orders:
+                side = int(o.is_buy)
+                rates = self.rates[side]
+                expiries = self.expiries[side]
+                expiry = expires_at(o.created_at)
+                lo = bisect_left(rates, o.usd_rate)
+                hi = bisect_right(rates, o.usd_rate, lo)
+                for i in range(lo, hi):
+                    if expiries[i] == expiry:
+                        self._tally(side, rates[i], expiry,
+                                    self.prices[side][i], -1)
+                        del rates[i]
+                        del expiries[i]
+                        del self.prices[side][i]
+                        self.expiry_sums[side] -= expiry
+                        self.strike_sums[side].add(strike_key(o.usd_rate),
+                                                   -expiry)
+                        self._unsort(side, expiry, o.usd_rate)
+                        break
+            self.version += 1
+
+    def expire(self, until):
+        """ drop every order expiring at or before `until` (epoch)
+        """
+        if not self.loaded:
+            return
+        with self.lock:
+            for side in (1, 0):
+                kept = []
+                for r, e, p in zip(self.rates[side], self.expiries[side],
+                                   self.prices[side]):
+                    if e > until:
+                        kept.append((r, e, p))
+                    else:
+                        self._tally(side, r, e, p, -1)
+                        self.strike_sums[side].add(strike_key(r), -e)
+                if len(kept) == len(self.rates[side]):
+                    continue
+                self.rates[side] = [r for r, _, _ in kept]
+                self.expiries[side] = [e for _, e, _ in kept]
+                self.prices[side] = [p for _, _, p in kept]
+                self.expiry_sums[side] = sum(self.expiries[side])
+                expired = bisect_right(self.by_expiry[side], until)
+                del self.by_expiry[side][:expired]
+                del self.by_expiry_rates[side][:expired]
+                self.version += 1
+
+    def net_options_out(self, usd_rate=None):
+        """ same counts as get_order_book(conn, usd_rate).net_options_out()
+        """
+        with self.lock:
+            return self._struck(1, usd_rate), self._struck(0, usd_rate)
+
+    def weighted_options_out(self, usd_rate=None, now=None):
+        """ outstanding buys and sells, each weighted by its remaining time
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            return self._weighted(usd_rate, now)
+
+    def get_quote(self, is_buy=True, usd_rate=None, now=None, quantity=1):
+        """ price of `quantity` options together, in units of payment
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            return self._quote(is_buy, usd_rate, now, quantity)
+
+    def summary(self, now=None):
+        """ count and notional of the open orders per side, by strike
+            bucket and by whole hours left to expiry
+        """
+        if now is None:
+            now = time.time()
+        hour = int(now) // HOUR
+        with self.lock:
+            buckets = list(self.buckets.items())
+            version = self.version
+        sides = {}
+        for name in ('up', 'down'):
+            sides[name] = {"count": 0, "notional": 0,
+                           "by_strike": {}, "by_expiry": {}}
+        for (is_buy, strike, expiry_hour), (count, notional) in buckets:
+            side = sides['up' if is_buy else 'down']
+            side["count"] += count
+            side["notional"] += notional
+            for key, group in ((strike, "by_strike"),
+                               (expiry_hour - hour, "by_expiry")):
+                totals = side[group].setdefault(key, [0, 0])
+                totals[0] += count
+                totals[1] += notional
+        for side in sides.values():
+            side["by_strike"] = [{"strike": k, "count": c, "notional": n}
+                for k, (c, n) in sorted(side["by_strike"].items())]
+            side["by_expiry"] = [{"hours": k, "count": c, "notional": n}
+                for k, (c, n) in sorted(side["by_expiry"].items())]
+        return {"version": version, "strike_bucket": STRIKE_BUCKET,
+                "sides": sides}
+
+    def summary_json(self, now=None):
+        """ (etag, body) of the summary; rendered once per book version
+            and hour, since the hours-to-expiry buckets shift on the hour.
+            The ETag is a hash of the body: `version` restarts with the
+            process, so it alone could match a client's copy of another book
+        """
+        if now is None:
+            now = time.time()
+        hour = int(now) // HOUR
+        cached = self._summary
+        if cached is not None and cached[:2] == (self.version, hour):
+            return cached[2:]
+        doc = self.summary(now)
+        version = doc["version"]
+        body = json.dumps(doc).encode('utf-8')
+        etag = hashlib.sha1(body).hexdigest()
+        self._summary = (version, hour, etag, body)
+        return etag, body
+
+    def check(self, conn):
+        """ compare against the orders table; True if consistent
+        """
+        book = LiveBook()
+        book.load(conn)
+        with self.lock:
+            return self.rates == book.rates and \
+                self.expiries == book.expiries and \
+                all(self.strike_sums[side].tree == book.strike_sums[side].tree
+                    for side in (1, 0))
+
+    def _insert(self, order):
+        side = int(order.is_buy)
+        expiry = expires_at(order.created_at)
+        i = bisect_right(self.rates[side], order.usd_rate)
+        self.rates[side].insert(i, order.usd_rate)
+        self.expiries[side].insert(i, expiry)
+        self.prices[side].insert(i, order.price or 0)
+        self.expiry_sums[side] += expiry
+        self.strike_sums[side].add(strike_key(order.usd_rate), expiry)
+        j = bisect_right(self.by_expiry[side], expiry)
+        self.by_expiry[side].insert(j, expiry)
+        self.by_expiry_rates[side].insert(j, order.usd_rate)
+        self._tally(side, order.usd_rate, expiry, order.price or 0, 1)
+        self.version += 1
+
+    def _unsort(self, side, expiry, usd_rate):
+        by_expiry = self.by_expiry[side]
+        rates = self.by_expiry_rates[side]
+        j = bisect_left(by_expiry, expiry)
+        while rates[j] != usd_rate:
+            j += 1
+        del by_expiry[j]
+        del rates[j]
+
+    def _tally(self, side, usd_rate, expiry, price, n):
+        key = (side, int(usd_rate // STRIKE_BUCKET) * STRIKE_BUCKET,
+               expiry // HOUR)
+        totals = self.buckets.get(key)
+        if totals is None:
+            totals = self.buckets[key] = [0, 0]
+        totals[0] += n
+        totals[1] += n*price
+        if not totals[0]:
+            del self.buckets[key]
+
+    def _notify(self, order):
+        for listener in self.listeners:
+            listener(order)
+
+    def _weighted(self, usd_rate, now):
+        return (self._side_weight(1, usd_rate, now),
+                self._side_weight(0, usd_rate, now))
+
+    def _side_weight(self, side, usd_rate, now):
+        # orders expired by `now` but not yet settled weigh nothing
+        by_expiry = self.by_expiry[side]
+        expired = bisect_right(by_expiry, now)
+        if usd_rate is None:
+            count, expiry_sum = len(by_expiry), self.expiry_sums[side]
+            skipped = by_expiry[:expired]
+        else:
+            count, expiry_sum = self._struck(side, usd_rate, True)
+            rates = self.by_expiry_rates[side][:expired]
+            skipped = [e for e, r in zip(by_expiry[:expired], rates)
+                       if (r >= usd_rate if side else r <= usd_rate)]
+        return time_weighted_q(count - len(skipped),
+                               expiry_sum - sum(skipped), now)
+
+    def _quote(self, is_buy, usd_rate, now, quantity=1):
+        num_buys, num_sells = self._weighted(usd_rate, now)
+        return calc_cost_many(num_buys, num_sells, quantity, is_buy)
+
+    def _struck(self, side, usd_rate, with_sum=False):
+        # count (and expiry sum) of the buys struck at or above usd_rate,
+        # or of the sells struck at or below it
+        rates = self.rates[side]
+        if usd_rate is None:
+            count = len(rates)
+            return (count, self.expiry_sums[side]) if with_sum else count
+        if side:
+            i = bisect_left(rates, usd_rate)
+            count = len(rates) - i
+        else:
+            i = bisect_right(rates, usd_rate)
+            count = i
+        if not with_sum:
+            return count
+        # whole cents from the tree; the orders in usd_rate's own cent
+        # but on the wrong side of it taken back out one by one
+        key = strike_key(usd_rate)
+        expiries = self.expiries[side]
+        j = i
+        if side:
+            while j and strike_key(rates[j-1]) == key:
+                j -= 1
+            expiry_sum = self.expiry_sums[side] - \
+                self.strike_sums[side].upto(key - 1) - sum(expiries[j:i])
+        else:
+            while j < len(rates) and strike_key(rates[j]) == key:
+                j += 1
+            expiry_sum = self.strike_sums[side].upto(key) - \
+                sum(expiries[i:j])
+        return count, expiry_sum
+
+live_book = LiveBook()
+
+class OrderWriter(object):
+    """ Group commit for order inserts
+
+        /buy handlers queue their orders and block; one writer thread
+        takes everything queued while its previous commit was running
+        (waiting up to `interval` seconds for more, at most `max_batch`
+        orders), inserts the lot with one executemany (crediting any
+        change alongside), and commits with synchronous=FULL. A handler
+        returns only once its order is on disk, but concurrent handlers
+        share the fsync.
+
+        However the thread ends (stop, or an error such as connect
+        failing) it clears `running` and fails every order still queued
+        with WriterStopped; `running` is checked under the same lock as
+        the queueing, so no handler is left waiting.
+    """
+
+    def __init__(self, interval=0, max_batch=500):
+        self.interval = interval
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.batches = 0  # transactions committed
+
+    def start(self, connect):
+        """ connect is called on the writer thread for its connection
+        """
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, args=(connect,),
+                                       name='order-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            if self.thread is None:
+                return
+            self.running = False
+            self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self._fail(self._drain(), WriterStopped("order writer stopped"))
+
+    def submit(self, order, change=0):
+        self.submit_all([order], change)
+
+    def submit_all(self, orders, change=0):
+        """ the orders of one purchase, committed together
+        """
+        pending = PendingOrder(orders, change)
+        with self.lock:
+            if not self.running:
+                raise WriterStopped("order writer stopped")
+            self.queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    pending = self.queue.get(timeout=timeout)
+                else:
+                    pending = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending is None:
+                self.queue.put(None)  # finish this batch, then stop
+                break
+            batch.append(pending)
+        return batch
+
+    def _run(self, connect):
+        batch = None
+        error = WriterStopped("order writer stopped")
+        try:
+            conn = connect()
+            try:
+                conn.execute("PRAGMA synchronous=FULL")
+                while True:
+                    batch = self._collect()
+                    if batch is None:
+                        return
+                    try:
+                        with conn:
+                            insert_orders(conn, batch)
+                        self.batches += 1
+                    except Exception:
+                        # one bad order must not fail its neighbours
+                        self._write_each(conn, batch)
+                        continue
+                    for p in batch:
+                        p.done.set()
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.exception("order writer failed: %s" % e)
+            error = WriterStopped("order writer failed: %s" % e)
+        finally:
+            with self.lock:
+                self.running = False
+            self._fail((batch or []) + self._drain(), error)
+
+    def _drain(self):
+        pending = []
+        while True:
+            try:
+                p = self.queue.get_nowait()
+            except queue.Empty:
+                return pending
+            if p is not None:
+                pending.append(p)
+
+    def _fail(self, pending, error):
+        for p in pending:
+            if not p.done.is_set():
+                p.error = error
+                p.done.set()
+
+    def _write_each(self, conn, batch):
+        for p in batch:
+            try:
+                with conn:
+                    insert_orders(conn, [p])
+                self.batches += 1
+            except Exception as e:
+                p.error = e
+            p.done.set()
+
+class PendingOrder(object):
+
+    def __init__(self, orders, change=0):
+        self.orders = orders
+        self.change = change  # credited to the orders' payout address
+        self.done = threading.Event()
+        self.error = None
+
+order_writer = OrderWriter()
 
 class OrderBook(object):
 
@@ -69,9 +765,16 @@ class OrderBook(object):
     def net_options_out(self):
         return len(self.buys()), len(self.sells())
 
-    def get_quote(self, is_buy=True):
+    def weighted_options_out(self, now=None):
+        if now is None:
+            now = time.time()
+        buys = sum(o.weight(now) for o in self.buys())
+        sells = sum(o.weight(now) for o in self.sells())
+        return buys, sells
+
+    def get_quote(self, is_buy=True, now=None):
         # calculate option price
-        num_buys, num_sells = self.net_options_out()
+        num_buys, num_sells = self.weighted_options_out(now)
         if is_buy:
             cost = calc_cost(num_buys+1, num_sells, True)
         else:
@@ -81,18 +784,126 @@ class OrderBook(object):
     def dump_all(self):
         return [o.to_json() for o in self.orders]
 
+class ColumnarOrderBook(object):
+    """ OrderBook stored as typed columns instead of Order objects
+
+        One array per field (side, strike, price, created_at as epoch
+        seconds, index into a table of distinct payout addresses), so a
+        large book costs a few dozen bytes per order rather than an object
+        each, and the quote is computed straight off the columns.
+    """
+
+    def __init__(self):
+        self.sides = array('b')
+        self.rates = array('d')
+        self.prices = array('q')
+        self.created = array('q')
+        self.address_ids = array('l')
+        self.addresses = []
+        self.address_index = {}
+
+    def append(self, is_buy, address, usd_rate, price, created):
+        address_id = self.address_index.get(address)
+        if address_id is None:
+            address_id = self.address_index[address] = len(self.addresses)
+            self.addresses.append(address)
+        self.sides.append(int(is_buy))
+        self.rates.append(usd_rate)
+        self.prices.append(price)
+        self.created.append(created)
+        self.address_ids.append(address_id)
+
+    def __len__(self):
+        return len(self.sides)
+
+    def order(self, i):
+        return Order(self.sides[i], self.addresses[self.address_ids[i]],
+                     self.rates[i], self.prices[i],
+                     datetime.utcfromtimestamp(self.created[i]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.order(i)
+
+    def buys(self):
+        return [self.order(i) for i in range(len(self)) if self.sides[i] == 1]
+
+    def sells(self):
+        return [self.order(i) for i in range(len(self)) if self.sides[i] == 0]
+
+    def top_of_book(self):
+        if not len(self):
+            return None
+        return self.order(0)
+
+    def net_options_out(self):
+        buys = self.sides.count(1)
+        return buys, self.sides.count(0)
+
+    def weighted_options_out(self, now=None):
+        if now is None:
+            now = time.time()
+        if np is not None:
+            # zero-copy views of the columns
+            sides = np.frombuffer(self.sides, dtype=np.int8)
+            created = np.frombuffer(self.created, dtype=np.int64)
+            remaining = np.clip(created + (EXPIRY_SECONDS - now), 0, None)
+            return (float(remaining[sides == 1].sum()) / EXPIRY_SECONDS,
+                    float(remaining[sides == 0].sum()) / EXPIRY_SECONDS)
+        weights = {1: 0.0, 0: 0.0}
+        for side, created in zip(self.sides, self.created):
+            weights[side] += time_weighted_q(1, created + EXPIRY_SECONDS, now)
+        return weights[1], weights[0]
+
+    def get_quote(self, is_buy=True, now=None):
+        num_buys, num_sells = self.weighted_options_out(now)
+        if is_buy:
+            cost = calc_cost(num_buys+1, num_sells, True)
+        else:
+            cost = calc_cost(num_buys, num_sells+1, False)
+        return cost
+
+    def dump_all(self):
+        return [o.to_json() for o in self]
+
 class Order(object):
+    __slots__ = ('is_buy', 'payout_address', 'usd_rate', 'price',
+                 'created_at', 'id')
 
-    def __init__(self, is_buy, payout_address, usd_rate, price):
-        self.is_buy = is_buy  # set to -1 to archive
+    def __init__(self, is_buy, payout_address, usd_rate, price,
+                 created_at=None, id=None):
+        self.is_buy = is_buy
         self.payout_address = payout_address  # user's btc address
         self.usd_rate = usd_rate  # bitcoin price
         self.price = price  # what the user paid; for bookkeeping only
+        self.created_at = created_at  # naive UTC datetime
+        self.id = id  # row id, where the query selected it
+
+    def weight(self, now):
+        # fraction of the option's life still to run
+        return time_weighted_q(1, expires_at(self.created_at), now)
+
+    def to_row(self):
+        return {"is_buy": self.is_buy,
+                "payout_address": self.payout_address,
+                "usd_rate": self.usd_rate,
+                "price": self.price,
+                "created_at": self.created_at.strftime(TIME_FORMAT)}
 
     def to_json(self):
-        return {
+        doc = {
             "is_buy": self.is_buy,
             "payout_address": self.payout_address,
             "usd_rate": self.usd_rate,
-            "price_paid": self.price
+            "price_paid": self.price,
+            "created_at": self.created_at.strftime(TIME_FORMAT) \
+                if self.created_at else None
         }
+        if self.id is not None:
+            doc["id"] = self.id
+        return doc
+
+def expires_at(created_at):
+    """ epoch seconds at which an order placed at created_at expires
+    """
+    return calendar.timegm(created_at.timetuple()) + EXPIRY_SECONDS
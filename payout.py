@@ -1,41 +1,224 @@
 """  Expiry/payout manager
+
+Settlement claims every order whose 24 hours have run in one set-based
+transaction: the rows are copied to orders_archive tagged with a claim
+marker and deleted from orders by that marker, so an order is settled
+exactly once no matter what is inserted meanwhile. The claimed orders
+are then streamed back in chunks, keeping memory flat however many
+expire together.
+
+The claim also records the BTCUSD rate it settles at, and each claimed
+winner stays owed (payout_id NULL) until a payout pays it. Winners are
+paid in multi-output transactions of at most MAX_OUTPUTS outputs (one per
+address) instead of one transaction per winning option. Every transaction
+is recorded in the payouts table, and its orders stamped with its id,
+before it is broadcast; the txid is filled in once it is sent. A payout
+row without a txid marks a batch whose outcome is unknown (the wallet
+raised, perhaps after broadcasting, or the process died): its orders are
+no longer owed, so they are never paid twice, and each settlement warns
+about such batches until they are checked against the wallet and either
+given their txid or handed back with release_batch.
+
+/buy does not send change back on the spot: it is credited to the
+payer's row in balances, and sweep_balances pays every balance that has
+reached SWEEP_THRESHOLD in the same kind of batched transaction, after
+each settlement. Swept balances are cleared before the broadcast and
+credited back if it fails.
 """
 
-from orderbook import Order
+import logging
+import time
+from datetime import datetime
 
+from orderbook import Order, live_book, parse_time, TIME_FORMAT
+from orderbook import CREDIT_CHANGE
+from price_rules import EXPIRY_SECONDS
 
-def execute_orders(conn):
-    c = conn.cursor()
-    orders = []
-    day_ago = datetime.now() - timedelta(hours=24)
-    for is_buy, address, usd_rate, price in c.execute("SELECT * FROM orders \
-        WHERE created_at >= ? ORDER BY created_at", day_ago):
-        orders.append(Order(is_buy, address, usd_rate, price))
-    c.execute("UPDATE orders SET is_buy = -1 WHERE created_at >= ?", day_ago)
-    return orders
+MAX_OUTPUTS = 100  # outputs per payout transaction
+CHUNK = 1000  # expired orders read per query while paying out
+SWEEP_THRESHOLD = 5000  # satoshis owed before a balance is paid out
+
+def execute_orders(conn, until=None):
+    """ claim the orders expired by `until` (epoch, default now) and
+        stream them back
+    """
+    if until is None:
+        until = time.time()
+    claim = claim_expired(conn, int(until))
+    live_book.expire(int(until))
+    return iter_claimed(conn, claim)
+
+def claim_expired(conn, until, usd_rate=None):
+    """ move every order whose 24 hours ended by `until` to the archive,
+        in one transaction; returns the claim marker stored as expired_at
+        winners at `usd_rate` are left owed; without a rate nothing is
+    """
+    cutoff = datetime.utcfromtimestamp(until - EXPIRY_SECONDS) \
+                .strftime(TIME_FORMAT)
+    claim = datetime.utcnow().strftime(TIME_FORMAT + '.%f')
+    with conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT INTO orders_archive(id, created_at, is_buy, \
+            payout_address, usd_rate, price, expired_at, settle_rate, \
+            payout_id) SELECT id, created_at, is_buy, payout_address, \
+            usd_rate, price, :claim, :rate, CASE \
+            WHEN is_buy = 1 AND :rate > usd_rate THEN NULL \
+            WHEN is_buy = 0 AND :rate < usd_rate THEN NULL ELSE 0 END \
+            FROM orders WHERE created_at <= :cutoff",
+            {"claim": claim, "rate": usd_rate, "cutoff": cutoff})
+        conn.execute("DELETE FROM orders WHERE id IN \
+            (SELECT id FROM orders_archive WHERE expired_at = ?)", (claim,))
+    return claim
+
+def iter_claimed(conn, claim, chunk=CHUNK):
+    """ the claimed orders, read `chunk` rows at a time
+    """
+    last_id = -1
+    while True:
+        rows = conn.execute("SELECT id, is_buy, payout_address, usd_rate, \
+            price, created_at FROM orders_archive \
+            WHERE expired_at = ? AND id > ? ORDER BY id LIMIT ?",
+            (claim, last_id, chunk)).fetchall()
+        if not rows:
+            return
+        for order_id, is_buy, address, usd_rate, price, created_at in rows:
+            yield Order(is_buy, address, usd_rate, price,
+                        parse_time(created_at))
+        last_id = rows[-1][0]
 
 def get_oldest(conn):
     c = conn.cursor()
     for created_at in c.execute("SELECT min(created_at) FROM orders WHERE is_buy >= 0"):
         return created_at
 
-def execute_payout(conn, wallet, usd_rate, payout):
-    orders = execute_orders(conn)
+def winners(orders, usd_rate):
     for o in orders:
         if o.is_buy == 1 and usd_rate > o.usd_rate or \
             o.is_buy == 0 and usd_rate < o.usd_rate:
-            wallet.send_to(o.payout_address, payout)
+            yield o
+
+def iter_owed(conn, chunk=CHUNK):
+    """ (id, payout_address) of every claimed winner not yet paid, oldest
+        first, read `chunk` rows at a time
+    """
+    last_id = -1
+    while True:
+        rows = conn.execute("SELECT id, payout_address FROM orders_archive \
+            WHERE payout_id IS NULL AND id > ? ORDER BY id LIMIT ?",
+            (last_id, chunk)).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_id = rows[-1][0]
+
+def pay_claimed(conn, wallet, usd_rate, payout, max_outputs=MAX_OUTPUTS,
+                chunk=CHUNK):
+    """ pay `payout` per owed winner, batching outputs by address
+        returns the txids sent
+    """
+    txids = []
+    outputs = {}
+    paid = []
+    for order_id, address in iter_owed(conn, chunk):
+        if address not in outputs and len(outputs) >= max_outputs:
+            txids.append(send_batch(conn, wallet, outputs, usd_rate, paid))
+            outputs = {}
+            paid = []
+        outputs[address] = outputs.get(address, 0) + payout
+        paid.append(order_id)
+    if outputs:
+        txids.append(send_batch(conn, wallet, outputs, usd_rate, paid))
+    return txids
+
+def send_batch(conn, wallet, outputs, usd_rate, order_ids=()):
+    with conn:
+        c = conn.execute("INSERT INTO payouts(usd_rate, num_outputs, amount) \
+            VALUES (?, ?, ?)", (usd_rate, len(outputs), sum(outputs.values())))
+        batch_id = c.lastrowid
+        conn.executemany("UPDATE orders_archive SET payout_id = ? \
+            WHERE id = ?", [(batch_id, order_id) for order_id in order_ids])
+    txid = wallet.send_to_multiple(outputs)[0]['txid']
+    with conn:
+        conn.execute("UPDATE payouts SET txid = ? WHERE id = ?",
+                     (txid, batch_id))
+    return txid
+
+def unconfirmed_batches(conn):
+    """ ids of the payouts recorded but never given a txid
+    """
+    return [batch_id for (batch_id,) in conn.execute("SELECT id \
+        FROM payouts WHERE txid IS NULL ORDER BY id")]
+
+def release_batch(conn, batch_id):
+    """ hand the orders of an unconfirmed batch back to be paid again,
+        once the wallet shows it never went out
+    """
+    with conn:
+        if not conn.execute("DELETE FROM payouts WHERE id = ? \
+                AND txid IS NULL", (batch_id,)).rowcount:
+            raise ValueError("no unconfirmed payout %d" % batch_id)
+        conn.execute("UPDATE orders_archive SET payout_id = NULL \
+            WHERE payout_id = ?", (batch_id,))
+
+def sweep_balances(conn, wallet, usd_rate, threshold=SWEEP_THRESHOLD,
+                   max_outputs=MAX_OUTPUTS):
+    """ pay out every balance of at least `threshold`, `max_outputs`
+        addresses per transaction; returns the txids sent
+    """
+    txids = []
+    while True:
+        outputs = claim_balances(conn, threshold, max_outputs)
+        if not outputs:
+            return txids
+        try:
+            txids.append(send_batch(conn, wallet, outputs, usd_rate))
+        except Exception:
+            credit_balances(conn, outputs)
+            raise
+
+def claim_balances(conn, threshold, limit):
+    """ debit up to `limit` balances of at least `threshold` in one
+        transaction; returns {address: amount}
+    """
+    with conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        outputs = dict(conn.execute("SELECT payout_address, amount \
+            FROM balances WHERE amount >= ? ORDER BY payout_address \
+            LIMIT ?", (threshold, limit)).fetchall())
+        conn.executemany("DELETE FROM balances WHERE payout_address = ?",
+                         [(address,) for address in outputs])
+    return outputs
+
+def credit_balances(conn, outputs):
+    with conn:
+        conn.executemany(CREDIT_CHANGE, [
+            {"payout_address": address, "change": amount}
+            for address, amount in outputs.items()])
+
+def execute_payout(conn, wallet, usd_rate, payout, max_outputs=MAX_OUTPUTS,
+                   until=None):
+    if until is None:
+        until = time.time()
+    claim_expired(conn, int(until), usd_rate)
+    live_book.expire(int(until))
+    # also pays winners handed back by release_batch
+    pay_claimed(conn, wallet, usd_rate, payout, max_outputs)
+    unconfirmed = unconfirmed_batches(conn)
+    if unconfirmed:
+        logging.warning("payouts %s have no txid: check them in the wallet, "
+                        "then record the txid or release_batch" % unconfirmed)
     # get the next newest 
     next_date = get_oldest(conn)
     return next_date
 
-def execute_mock(conn, wallet, usd_rate, payout):
-    orders = execute_orders(conn)
+def execute_mock(conn, wallet, usd_rate, payout, until=None):
+    orders = execute_orders(conn, until)
     total_payout = 0
-    for o in orders:
-        if o.is_buy == 1 and usd_rate > o.usd_rate or \
-            o.is_buy == 0 and usd_rate < o.usd_rate:
-            total_payout += payout
+    for o in winners(orders, usd_rate):
+        total_payout += payout
     print("Total Payout: %d" % total_payout)
     # get the next newest 
     next_date = get_oldest(conn)
@@ -0,0 +1,87 @@
+"""  Cached BTCUSD price feed
+
+A background thread refreshes the rate from `source` (a PriceSource or a
+PriceOracle) every `interval` seconds; readers are served from memory. A
+cached value older than `max_staleness` seconds is never served: the
+reader refreshes it synchronously, or gets StalePrice if the source is
+down.
+"""
+import logging
+import threading
+import time
+
+from price_oracle import PriceUnavailable
+
+class StalePrice(PriceUnavailable):
+    pass
+
+class PriceFeed(object):
+
+    def __init__(self, source, interval=10, max_staleness=60):
+        self.source = source
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.rate = None
+        self.updated_at = None  # time.monotonic() of the last good fetch
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def refresh(self):
+        rate = self.source.fetch()
+        with self.lock:
+            self.rate = rate
+            self.updated_at = time.monotonic()
+        return rate
+
+    def age(self):
+        """ seconds since the cached rate was fetched, None if never
+        """
+        with self.lock:
+            if self.updated_at is None:
+                return None
+            return time.monotonic() - self.updated_at
+
+    def get(self):
+        rate, age = self._cached()
+        if rate is not None and age <= self.max_staleness:
+            return rate
+        # only one reader goes upstream, the rest wait for its result
+        with self.refresh_lock:
+            rate, age = self._cached()
+            if rate is not None and age <= self.max_staleness:
+                return rate
+            try:
+                return self.refresh()
+            except PriceUnavailable as e:
+                raise StalePrice("no BTCUSD rate newer than %ds: %s" %
+                                 (self.max_staleness, e))
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='price-feed')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _cached(self):
+        with self.lock:
+            if self.updated_at is None:
+                return None, None
+            return self.rate, time.monotonic() - self.updated_at
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+            except PriceUnavailable as e:
+                logging.warning("price feed refresh failed: %s" % e)
+            self.stopped.wait(self.interval)
@@ -0,0 +1,130 @@
+"""  Signed price locks
+
+/quote/lock prices options off the current book and hands the client a
+lock: side, quantity, total price, BTCUSD rate, expiry and a nonce,
+signed with HMAC-SHA256. /buy then charges exactly the locked price, so
+no change is owed.
+
+Every check happens before the payment is taken, and costs one HMAC: a
+lock is refused once it has expired, been used, or BTCUSD has moved more
+than `rate_tolerance` from the rate it was priced at. The strike is
+BTCUSD at /buy. /buy then redeems the lock and fills at the locked price
+whatever the book has done since, so a paid order is never turned away;
+redeeming puts its nonce in a set of used nonces, pruned as their locks
+expire, so each lock buys once.
+"""
+import binascii
+import hashlib
+import heapq
+import hmac
+import os
+import threading
+import time
+
+LOCK_TTL = 30  # seconds a locked price can be paid
+SIG_LENGTH = 32  # hex digits of the HMAC kept in a lock
+NONCE_BYTES = 8
+RATE_TOLERANCE = 0.005  # fraction BTCUSD may move between lock and /buy
+
+class LockInvalid(Exception):
+    pass
+
+class PriceLock(object):
+
+    def __init__(self, secret, ttl=LOCK_TTL, rate_tolerance=RATE_TOLERANCE):
+        self.secret = secret  # bytes
+        self.ttl = ttl
+        self.rate_tolerance = rate_tolerance
+        self.lock = threading.Lock()
+        self.used = set()  # nonces of redeemed locks
+        self.expiries = []  # heap of (expires, nonce) over used
+
+    def issue(self, is_buy, price, usd_rate, now=None, quantity=1):
+        if now is None:
+            now = time.time()
+        nonce = binascii.hexlify(os.urandom(NONCE_BYTES)).decode('ascii')
+        payload = '%d:%d:%d:%r:%d:%s' % (int(is_buy), quantity, price,
+                                         float(usd_rate), int(now) + self.ttl,
+                                         nonce)
+        return payload + ':' + self._sign(payload)
+
+    def verify(self, token, is_buy, now=None, quantity=1, usd_rate=None):
+        """ (price, usd_rate) locked by `token` for this side and
+            quantity, if it is unexpired and unused and BTCUSD (if given)
+            is still near the locked rate
+        """
+        if now is None:
+            now = time.time()
+        price, locked_rate, expires, nonce = self._open(token, is_buy,
+                                                        quantity)
+        if now > expires:
+            raise LockInvalid("price lock expired")
+        if usd_rate is not None:
+            self._check_rate(locked_rate, usd_rate)
+        with self.lock:
+            if nonce in self.used:
+                raise LockInvalid("price lock already used")
+        return price, locked_rate
+
+    def redeem(self, token, is_buy, now=None, quantity=1):
+        """ use up `token`, checked by verify when its payment was taken;
+            returns the locked price
+            a lock is honoured until `ttl` past its expiry, as long as
+            its nonce is remembered
+        """
+        if now is None:
+            now = time.time()
+        price, locked_rate, expires, nonce = self._open(token, is_buy,
+                                                        quantity)
+        if now > expires + self.ttl:
+            raise LockInvalid("price lock expired")
+        with self.lock:
+            self._prune(now)
+            if nonce in self.used:
+                raise LockInvalid("price lock already used")
+            self.used.add(nonce)
+            heapq.heappush(self.expiries, (expires, nonce))
+        return price
+
+    def locked_price(self, token):
+        """ the price signed into `token`, whatever else is wrong with it
+        """
+        payload, sig = self._check_sig(token)
+        return int(payload.split(':')[2])
+
+    def _open(self, token, is_buy, quantity):
+        payload, sig = self._check_sig(token)
+        try:
+            side, count, price, usd_rate, expires, nonce = payload.split(':')
+            side, count, price = int(side), int(count), int(price)
+            usd_rate, expires = float(usd_rate), int(expires)
+        except ValueError:
+            raise LockInvalid("malformed price lock")
+        if side != int(is_buy):
+            raise LockInvalid("price lock is for the other side")
+        if count != quantity:
+            raise LockInvalid("price lock is for %d options" % count)
+        return price, usd_rate, expires, nonce
+
+    def _check_sig(self, token):
+        try:
+            payload, sig = token.rsplit(':', 1)
+        except (AttributeError, ValueError):
+            raise LockInvalid("malformed price lock")
+        if not hmac.compare_digest(sig, self._sign(payload)):
+            raise LockInvalid("bad price lock signature")
+        return payload, sig
+
+    def _check_rate(self, locked_rate, usd_rate):
+        if abs(usd_rate - locked_rate) > self.rate_tolerance * locked_rate:
+            raise LockInvalid("BTCUSD moved from %.2f to %.2f" %
+                              (locked_rate, usd_rate))
+
+    def _prune(self, now):
+        # past expiry + ttl redeem refuses a lock anyway
+        while self.expiries and self.expiries[0][0] + self.ttl < now:
+            self.used.discard(heapq.heappop(self.expiries)[1])
+
+    def _sign(self, payload):
+        return hmac.new(self.secret, payload.encode('utf-8'),
+                        hashlib.sha256).hexdigest()[:SIG_LENGTH]
@@ -0,0 +1,63 @@
+"""  Multi-source BTCUSD price oracle
+
+Every source is queried concurrently and the oracle takes the median of
+those that answer within `deadline` seconds, so one slow or wrong
+provider neither holds up a quote nor moves the price. When nothing
+answers in time fetch raises PriceUnavailable; PriceFeed then keeps
+serving the last good median until it is older than its max_staleness.
+
+A source is anything with a fetch() that returns a float rate.
+"""
+import logging
+import statistics
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+
+class PriceUnavailable(Exception):
+    pass
+
+class PriceSource(object):
+    """ JSON endpoint; path walks the response down to the rate
+    """
+
+    def __init__(self, name, url, path, timeout=5, session=None):
+        self.name = name
+        self.url = url
+        self.path = path
+        self.timeout = timeout
+        self.session = session or requests.Session()
+
+    def fetch(self):
+        try:
+            r = self.session.get(self.url, timeout=self.timeout)
+            r.raise_for_status()
+            value = r.json()
+            for key in self.path:
+                value = value[key]
+            return float(value)
+        except (requests.RequestException, ValueError, KeyError,
+                IndexError, TypeError) as e:
+            raise PriceUnavailable("%s: %s" % (self.name, e))
+
+class PriceOracle(object):
+
+    def __init__(self, sources, deadline=2.0):
+        self.sources = sources
+        self.deadline = deadline
+        # room for a round of stragglers still running past the deadline
+        self.executor = ThreadPoolExecutor(max_workers=2*len(sources))
+
+    def fetch(self):
+        futures = [self.executor.submit(s.fetch) for s in self.sources]
+        done, _ = wait(futures, timeout=self.deadline)
+        rates = []
+        for f in done:
+            try:
+                rates.append(f.result())
+            except Exception as e:
+                logging.warning("price source failed: %s" % e)
+        if not rates:
+            raise PriceUnavailable("no price source answered within %.1fs" %
+                                   self.deadline)
+        return statistics.median(rates)
@@ -10,19 +10,44 @@ General cost function:
 
     SPREAD is a constant that represents the "cut" taken by the market-maker.
 
-    TODO: normalize q with regards to expiry date
+    Both C and its price p_i = e^(qi/B) / (e^(q1/B)+e^(q2/B)) are evaluated
+    in log-sum-exp form, shifted by max(q1, q2), so they hold for books of
+    any size instead of overflowing e^(q/B) past ~10,600 options.
+
+    q is normalized with regards to expiry date: each outstanding option
+    counts for the fraction of its 24 hours still to run, so the book
+    decays smoothly instead of jumping when a batch expires.
 """
 import math
 import logging
 
+try:
+    import numpy as np
+except ImportError:  # only the batch API needs numpy
+    np = None
+
 B_FACTOR = 15.000  # results in a max loss of about 10
 DEFAULT_SPREAD = 0.0
 DEFAULT_MIN = 0.001
 DEFAULT_MAX = 1.000
 RANGE = DEFAULT_MAX - DEFAULT_MIN
+EXPIRY_SECONDS = 24 * 60 * 60
+
+def time_weighted_q(count, expiry_sum, now):
+    """ sum of (expiry - now) / EXPIRY_SECONDS over `count` options,
+        given only the sum of their expiry times
+    """
+    return max(0.0, (expiry_sum - count*now) / EXPIRY_SECONDS)
+
+def cost_function(buys, sells):
+    # C = m + B * ln(e^((q1-m)/B) + e^((q2-m)/B)), m = max(q1, q2)
+    m = max(buys, sells)
+    return m + B_FACTOR * math.log1p(math.exp(-abs(buys - sells)/B_FACTOR))
 
 def price_function(q, buys, sells):
-    c = math.exp(q/B_FACTOR) / ( math.exp(buys/B_FACTOR) + math.exp(sells/B_FACTOR))
+    m = max(buys, sells)
+    c = math.exp((q - m)/B_FACTOR) / \
+        (math.exp((buys - m)/B_FACTOR) + math.exp((sells - m)/B_FACTOR))
     return c
 
 def calc_cost(buys, sells, is_buy=True):
@@ -37,6 +62,83 @@ def calc_cost(buys, sells, is_buy=True):
     price_adj = (1 + DEFAULT_SPREAD) * price * RANGE + DEFAULT_MIN
     return price_adj
 
+def calc_cost_many(buys, sells, quantity, is_buy=True):
+    """ total price of `quantity` options bought together, given the book
+        before the order: each priced by calc_cost as if bought one after
+        another, so an order costs the same however it is split up
+    """
+    if is_buy:
+        return sum(calc_cost(buys+k, sells, True)
+                   for k in range(1, quantity+1))
+    return sum(calc_cost(buys, sells+k, False)
+               for k in range(1, quantity+1))
+
 def calc_belief(buys, sells):
     belief = price_function(buys, buys, sells)
-    return belief
\ No newline at end of file
+    return belief
+
+def cost_function_batch(buys, sells):
+    """ cost_function over arrays of book states
+    """
+    buys = np.asarray(buys, dtype=float)
+    sells = np.asarray(sells, dtype=float)
+    return B_FACTOR * np.logaddexp(buys/B_FACTOR, sells/B_FACTOR)
+
+def price_function_batch(q, buys, sells):
+    """ price_function over arrays of book states
+    """
+    q = np.asarray(q, dtype=float)
+    buys = np.asarray(buys, dtype=float)
+    sells = np.asarray(sells, dtype=float)
+    m = np.maximum(buys, sells)
+    return np.exp((q - m)/B_FACTOR) / \
+        (np.exp((buys - m)/B_FACTOR) + np.exp((sells - m)/B_FACTOR))
+
+def calc_cost_batch(buys, sells, is_buy=True):
+    """ calc_cost over arrays of book states
+        is_buy may be a scalar or an array of sides
+    """
+    buys = np.asarray(buys)
+    sells = np.asarray(sells)
+    price = price_function_batch(np.where(is_buy, buys, sells), buys, sells)
+    return (1 + DEFAULT_SPREAD) * price * RANGE + DEFAULT_MIN
+
+class CostTable(object):
+    """ calc_cost precomputed for whole 0 <= buys, sells < size
+        other states (outside the table, or the fractional time-weighted
+        q of a live book) are computed on the fly
+    """
+
+    def __init__(self, size=512):
+        self.size = size
+        buys = np.arange(size)[:, None]
+        sells = np.arange(size)[None, :]
+        # indexed by [is_buy, buys, sells]
+        self.costs = np.stack([calc_cost_batch(buys, sells, False),
+                               calc_cost_batch(buys, sells, True)])
+
+    def cost(self, buys, sells, is_buy=True):
+        if 0 <= buys < self.size and 0 <= sells < self.size and \
+                buys == int(buys) and sells == int(sells):
+            return float(self.costs[int(bool(is_buy)), int(buys), int(sells)])
+        return calc_cost(buys, sells, is_buy)
+
+    def cost_batch(self, buys, sells, is_buy=True):
+        buys = np.asarray(buys, dtype=float)
+        sells = np.asarray(sells, dtype=float)
+        buys, sells = np.broadcast_arrays(buys, sells)
+        inside = (buys >= 0) & (buys < self.size) & \
+                 (sells >= 0) & (sells < self.size) & \
+                 (buys == np.floor(buys)) & (sells == np.floor(sells))
+        if inside.all():
+            return self.costs[np.asarray(is_buy, dtype=np.intp),
+                              buys.astype(np.intp), sells.astype(np.intp)]
+        side = np.broadcast_to(is_buy, inside.shape)
+        cost = np.empty(inside.shape)
+        cost[inside] = self.costs[side[inside].astype(np.intp),
+                                  buys[inside].astype(np.intp),
+                                  sells[inside].astype(np.intp)]
+        outside = ~inside
+        cost[outside] = calc_cost_batch(buys[outside], sells[outside],
+                                        side[outside])
+        return cost
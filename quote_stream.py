@@ -0,0 +1,122 @@
+"""  Quote broadcaster for /quote/stream
+
+One thread computes the quote when the book or the BTCUSD rate changes.
+It publishes the quote as a ready-made server-sent event, and every
+subscriber waits on the same Condition and sends those bytes. A new
+quote therefore costs one computation however many clients listen. A
+slow subscriber skips to the latest quote instead of queueing old ones.
+
+Fills and additions wake the thread at once. Expiries, rate moves and
+the time decay of the weights (a new quote every `tick` seconds, as the
+quote cache) are picked up by polling every `poll` seconds.
+"""
+import json
+import logging
+import threading
+import time
+
+from orderbook import live_book, QUOTE_TICK
+from price_oracle import PriceUnavailable
+
+POLL = 1  # seconds between checks of the BTCUSD rate and the book
+KEEPALIVE = 15  # seconds between comment lines on a quiet stream
+KEEPALIVE_EVENT = b': keepalive\n\n'
+
+class QuoteBroadcaster(object):
+
+    def __init__(self, get_rate, book=None, poll=POLL, keepalive=KEEPALIVE,
+                 tick=QUOTE_TICK):
+        self.get_rate = get_rate
+        self.book = book
+        self.poll = poll
+        self.tick = tick
+        self.keepalive = keepalive
+        self.cond = threading.Condition()
+        self.changed = threading.Event()
+        self.seq = 0  # number of the last event published
+        self.event = None  # the last event, SSE-encoded
+        self.key = None  # (book version, usd_rate, tick) of the last event
+        self.listeners = []  # called with (seq, event) on each publish
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped = False
+        (self.book or live_book).listeners.append(self.wake)
+        self.thread = threading.Thread(target=self._run, name='quote-stream')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.changed.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            (self.book or live_book).listeners.remove(self.wake)
+
+    def wake(self, order=None):
+        self.changed.set()
+
+    def refresh(self, now=None):
+        """ publish a new event if the book or the rate moved or a new
+            tick started; True if one was published
+        """
+        if now is None:
+            now = time.time()
+        book = self.book or live_book
+        try:
+            usd_rate = self.get_rate()
+        except PriceUnavailable as e:
+            logging.warning("quote stream: %s" % e)
+            return False
+        key = (book.version, usd_rate, int(now // self.tick))
+        if key == self.key:
+            return False
+        data = json.dumps({"usd_rate": usd_rate,
+                           "buy": book.get_quote(True, None, now),
+                           "sell": book.get_quote(False, None, now)})
+        with self.cond:
+            self.seq += 1
+            self.key = key
+            self.event = ('id: %d\nevent: quote\ndata: %s\n\n' %
+                          (self.seq, data)).encode('utf-8')
+            seq, event = self.seq, self.event
+            self.cond.notify_all()
+        for listener in self.listeners:
+            listener(seq, event)
+        return True
+
+    def latest(self):
+        with self.cond:
+            return self.seq, self.event
+
+    def subscribe(self):
+        """ events for one client: the current quote, then each new one,
+            with a keepalive comment when nothing changes
+        """
+        seq = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.seq != seq or self.stopped,
+                                   self.keepalive)
+                if self.stopped:
+                    return
+                if self.seq == seq:
+                    event = KEEPALIVE_EVENT
+                else:
+                    seq, event = self.seq, self.event
+            yield event
+
+    def _run(self):
+        while not self.stopped:
+            self.changed.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.exception("quote stream refresh failed: %s" % e)
+            self.changed.wait(self.poll)
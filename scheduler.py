@@ -0,0 +1,104 @@
+"""  Expiry scheduler
+
+Keeps a min-heap of the expiry times (epoch seconds) of the open orders
+and sleeps until the earliest one. Expiries that fall within `window`
+seconds of it are coalesced: the scheduler waits for the last of them and
+settles the whole group with one settle(until) call, so no option is
+settled early and none more than `window` seconds late.
+
+On start the heap is rebuilt from the live orders table only (expired
+orders have been moved to orders_archive); new orders are pushed as they
+are added to the book.
+"""
+import heapq
+import logging
+import threading
+import time
+
+from price_rules import EXPIRY_SECONDS
+
+class ExpiryScheduler(object):
+
+    def __init__(self, settle, window=5, retry=60):
+        self.settle = settle
+        self.window = window
+        self.retry = retry  # seconds to back off after a failed settlement
+        self.heap = []
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.thread = None
+
+    def load(self, conn):
+        c = conn.cursor()
+        expiries = [created + EXPIRY_SECONDS for (created,) in c.execute(
+            "SELECT CAST(strftime('%s', created_at) AS INTEGER) FROM orders \
+                WHERE is_buy >= 0")]
+        with self.cond:
+            self.heap = expiries
+            heapq.heapify(self.heap)
+            self.cond.notify()
+
+    def add(self, expiry):
+        with self.cond:
+            heapq.heappush(self.heap, expiry)
+            if self.heap[0] == expiry:
+                self.cond.notify()
+
+    def next_expiry(self):
+        with self.cond:
+            return self.heap[0] if self.heap else None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name='expiry')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _next_group(self):
+        """ block until an expiry is due, then pop it and everything within
+            the window after it; returns the last expiry of the group
+        """
+        with self.cond:
+            while not self.stopped:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                wait = self.heap[0] - time.time()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                end = self.heap[0] + self.window
+                until = heapq.heappop(self.heap)
+                while self.heap and self.heap[0] <= end:
+                    until = heapq.heappop(self.heap)
+                return until
+            return None
+
+    def _sleep_until(self, until):
+        with self.cond:
+            while not self.stopped and time.time() < until:
+                self.cond.wait(until - time.time())
+            return not self.stopped
+
+    def _run(self):
+        while True:
+            until = self._next_group()
+            if until is None or not self._sleep_until(until):
+                return
+            try:
+                self.settle(until)
+            except Exception as e:
+                logging.exception("settlement up to %d failed: %s" % (until, e))
+                self.add(until)
+                with self.cond:
+                    self.cond.wait(self.retry)
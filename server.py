@@ -1,41 +1,39 @@
-import yaml
-
 import os 
 import json
 import requests
 import logging
 
-import sqlite3
-from flask import g
 from flask import send_from_directory
 
-# import from the 21 Developer Library
-from two1.lib.wallet import Wallet
-from two1.lib.bitserv.flask import Payment
-
 # import flask web microframework
 from flask import Flask
 from flask import request
+from flask import Response, stream_with_context
 
 # vending machine stuff
-from orderbook import add_to_book, get_order_book, get_book_quote
+from orderbook import add_to_book, live_book, QuoteCache
+from orderbook import iter_orders, dump_stream
+from payout import credit_balances
 import machine_app
+# the 21 Developer Library, or its stand-in with VENDING_OFFLINE=1
+from machine_app import Payment
+from price_lock import LOCK_TTL, LockInvalid
+from manifest import Manifest
+import db
 
 DATABASE = "book.db"
 
-def get_db(app):
-    with app.app_context():
-        db = getattr(g, '_database', None)
-        if db is None:
-            db = g._database = connect_to_database()
-        return db
-        
-def connect_to_database():
-    return sqlite3.connect(DATABASE)
-
-app = machine_app.vending_machine()
-conn = get_db(app)
+app = machine_app.vending_machine(DATABASE, machine_app.wallet)
+pool = db.init_app(app, DATABASE)
+with pool.connection() as conn:
+    live_book.load(conn)
+
+def render_quote(q, buy_price, sell_price):
+    return 'BTCUSD: %.5f  buy: %.5f, sell: %.5f' % (q, buy_price, sell_price)
+
+quote_cache = QuoteCache(render_quote)
 payment = Payment(app, machine_app.wallet)
+manifest = Manifest()
 
 # fetch current bitcoin price
 @app.route('/btc_quote')
@@ -48,13 +46,42 @@ def btc_quote():
 @app.route('/quote')
 def price_quote():
     logging.info("quote")
+    try:
+        quantity = machine_app.quantity_arg(request.args)
+    except ValueError as e:
+        return "Bad quantity: %s" % e, 400
     q = machine_app.get_quote()
-    buy_price, sell_price = get_book_quote(conn, q)
-    return 'BTCUSD: %.5f  buy: %.5f, sell: %.5f' % (q, buy_price, sell_price)
+    return quote_cache.get(q, quantity=quantity)
+
+# push a quote event whenever the book or BTCUSD moves
+@app.route('/quote/stream')
+def quote_stream():
+    return Response(machine_app.quote_broadcaster.subscribe(),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/quote/stats')
+def quote_stats():
+    return json.dumps(quote_cache.stats())
     
-# buy a bitcoin option - require payment at max price, return the change
+# lock the price of `quantity` options, good for LOCK_TTL seconds
+@app.route('/quote/lock')
+def lock_quote():
+    logging.info("lock")
+    action = request.args.get('action')
+    if action not in ('up', 'down'):
+        return "Required: action (up/down)", 400
+    try:
+        quantity = machine_app.quantity_arg(request.args)
+    except ValueError as e:
+        return "Bad quantity: %s" % e, 400
+    price, usd_rate, lock = machine_app.lock_quote(action == 'up', quantity)
+    return json.dumps({"action": action, "quantity": quantity, "price": price,
+                       "usd_rate": usd_rate, "expires_in": LOCK_TTL, "lock": lock})
+
+# buy bitcoin options - require payment of exactly the locked price
 @app.route('/buy')
-@payment.required(machine_app.PAYMENT_REQ)
+@payment.required(machine_app.locked_price)
 def purchase():
     logging.info("buy")
     # extract payout address from client address
@@ -67,36 +94,58 @@ def purchase():
     if not action:
         return "Required: action"
 
+    # the price the client locked and paid, struck at BTCUSD now (checked
+    # against the lock's rate before payment); each lock buys once
+    quantity = machine_app.quantity_arg(request.args)
+    lock = request.args.get('lock')
     usd_rate = machine_app.get_quote()
-
-    # add to book
-    if action == 'up':
-        change = add_to_book(conn, client_payout_addr, machine_app.PAYMENT_REQ, usd_rate, True)
-    else:
-        change = add_to_book(conn, client_payout_addr, machine_app.PAYMENT_REQ, usd_rate, False)
-
     try:
-        txid = machine_app.wallet.send_to(client_payout_addr, change)
-    except ValueError:
-        txid = machine_app.wallet.send_to(client_payout_addr, machine_app.PAYMENT_REQ)
-        return "Ugh, dust problem. Payment refunded"
-    return "Paid %d. BTCUSD is currently %.5f and will go %s." % \
-            (machine_app.PAYMENT_REQ - change, usd_rate, action)
+        price = machine_app.price_lock.redeem(lock, action == 'up',
+                                              quantity=quantity)
+    except LockInvalid as e:
+        # the same lock paid twice at once: the second payment goes to
+        # the address's balance
+        paid = machine_app.price_lock.locked_price(lock)
+        credit_balances(db.get_db(), {client_payout_addr: paid})
+        return "%s. %d credited to %s, get a new lock from /quote/lock" % \
+                (e, paid, client_payout_addr), 409
+
+    # add to book, all options in one transaction
+    add_to_book(db.get_db(), client_payout_addr, machine_app.PAYMENT_REQ,
+                usd_rate, action == 'up', price=price, quantity=quantity)
+    return "Paid %d for %d. BTCUSD is currently %.5f and will go %s." % \
+            (price, quantity, usd_rate, action)
+
+@app.route('/book/summary')
+def book_summary():
+    logging.info("summary")
+    live_book.ensure_loaded(db.get_db())
+    etag, body = live_book.summary_json()
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
 @app.route('/show')
 def show_book():
     logging.info("show")
-    book = get_order_book(conn)
-    return json.dumps(book.dump_all())
+    try:
+        after_id, limit, is_buy = machine_app.page_args(request.args)
+    except ValueError as e:
+        return "Bad page: %s" % e, 400
+    orders = iter_orders(db.get_db(), after_id, limit, is_buy)
+    return Response(stream_with_context(dump_stream(orders)),
+                    mimetype='application/json')
 
 @app.route('/manifest')
 def docs():
     '''
     Serves the app manifest to the 21 crawler.
     '''
-    with open('manifest.yaml', 'r') as f:
-        manifest_yaml = yaml.load(f)
-    return json.dumps(manifest_yaml)
+    body, etag, last_modified = manifest.get()
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response.make_conditional(request)
 
 @app.route('/client')
 def client():
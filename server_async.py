@@ -0,0 +1,302 @@
+""" asyncio (ASGI) variant of the vending API, without 21 payments
+
+Same routes as the Flask servers. /buy takes no payment, as in
+server_dev.py. A request in flight holds a coroutine instead of a thread:
+BTCUSD is read from the price feed's cache (only a stale cache goes
+upstream, on the executor), /quote comes from the quote cache, and all
+SQLite work runs on a ThreadPoolExecutor no bigger than the connection
+pool. An asyncio semaphore hands out the pool's connections, so executor
+threads never block waiting for one.
+
+    uvicorn server_async:app --port 5001
+    python3 server_async.py
+"""
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import format_datetime, parsedate_to_datetime
+from functools import partial
+from itertools import islice
+from urllib.parse import parse_qsl
+
+# vending machine stuff
+from orderbook import add_to_book, live_book, QuoteCache
+from orderbook import iter_orders, dump_stream
+from manifest import Manifest
+from price_oracle import PriceUnavailable
+from quote_stream import KEEPALIVE_EVENT
+import machine_app
+import db
+
+DATABASE = "book.db"
+STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+PORT = 5001  # next to a Flask server on 5000, for comparison
+STREAM_CHUNK = 500  # /show orders read per executor call
+
+JSON = b'application/json'
+TEXT = b'text/html; charset=utf-8'
+
+machine_app.start_machine(DATABASE)
+pool = db.ConnectionPool(DATABASE)
+with pool.connection() as conn:
+    live_book.load(conn)
+executor = ThreadPoolExecutor(max_workers=db.POOL_SIZE)
+db_slots = asyncio.Semaphore(db.POOL_SIZE)
+manifest = Manifest()
+
+def render_quote(q, buy_price, sell_price):
+    return 'BTCUSD: %.5f  buy: %.5f, sell: %.5f' % (q, buy_price, sell_price)
+
+quote_cache = QuoteCache(render_quote)
+
+class Request(object):
+
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        self.headers = {}
+        for name, value in scope['headers']:
+            name = name.decode('latin-1')
+            value = value.decode('latin-1')
+            if name in self.headers:
+                value = self.headers[name] + ',' + value
+            self.headers[name] = value
+
+def response(body, status=200, content_type=TEXT, headers=()):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return status, [(b'content-type', content_type)] + list(headers), body
+
+def not_modified(request, etag, last_modified):
+    match = request.headers.get('if-none-match')
+    if match is not None:
+        tags = [t.strip() for t in match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+    since = request.headers.get('if-modified-since')
+    if since and last_modified is not None:
+        try:
+            return last_modified <= parsedate_to_datetime(since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def conditional(request, body, content_type, etag, last_modified=None):
+    etag = '"%s"' % etag
+    headers = [(b'etag', etag.encode('latin-1'))]
+    if last_modified is not None:
+        headers.append((b'last-modified',
+            format_datetime(last_modified, usegmt=True).encode('latin-1')))
+    if not_modified(request, etag, last_modified):
+        return 304, headers, b''
+    return response(body, content_type=content_type, headers=headers)
+
+async def blocking(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(fn, *args))
+
+async def with_db(fn, *args):
+    """ fn(conn, *args) on the executor, with a pooled connection
+    """
+    async with db_slots:
+        conn = await blocking(pool.acquire)
+        try:
+            return await blocking(fn, conn, *args)
+        finally:
+            pool.release(conn)
+
+async def get_usd_rate():
+    feed = machine_app.price_feed
+    age = feed.age()
+    if age is not None and age <= feed.max_staleness:
+        return feed.get()  # from memory
+    return await blocking(feed.get)
+
+# fetch current bitcoin price
+async def btc_quote(request):
+    return response('%.5f' % await get_usd_rate())
+
+# fetch option price
+async def price_quote(request):
+    try:
+        quantity = machine_app.quantity_arg(request.args)
+    except ValueError as e:
+        return response("Bad quantity: %s" % e, 400)
+    return response(quote_cache.get(await get_usd_rate(), quantity=quantity))
+
+class QuoteFanout(object):
+    """ wakes every /quote/stream coroutine when the broadcaster
+        publishes: each publish sets the current asyncio.Event and
+        replaces it with a fresh one
+    """
+
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.loop = None
+        self.published = None
+
+    def attach(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.published = asyncio.Event()
+            self.broadcaster.listeners.append(self.notify)
+
+    def notify(self, seq, event):
+        # on the broadcaster thread
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        published, self.published = self.published, asyncio.Event()
+        published.set()
+
+    async def subscribe(self):
+        self.attach()
+        seq = 0
+        while True:
+            published = self.published
+            latest, event = self.broadcaster.latest()
+            if latest != seq:
+                seq = latest
+                yield event
+                continue
+            try:
+                await asyncio.wait_for(published.wait(),
+                                       self.broadcaster.keepalive)
+            except asyncio.TimeoutError:
+                yield KEEPALIVE_EVENT
+
+quote_fanout = QuoteFanout(machine_app.quote_broadcaster)
+
+# push a quote event whenever the book or BTCUSD moves
+async def quote_stream(request):
+    return 200, [(b'content-type', b'text/event-stream'),
+                 (b'cache-control', b'no-cache')], quote_fanout.subscribe()
+
+async def quote_stats(request):
+    return response(json.dumps(quote_cache.stats()), content_type=JSON)
+
+# buy a bitcoin option, no payment: return the change
+async def purchase(request):
+    client_payout_addr = request.args.get('payout_address')
+    # price movement: up or down
+    action = request.args.get('action')
+
+    if not client_payout_addr:
+        return response("Required: payout_address. You know, for when you win.")
+    if not action:
+        return response("Required: action")
+    try:
+        quantity = machine_app.quantity_arg(request.args)
+    except ValueError as e:
+        return response("Bad quantity: %s" % e, 400)
+
+    usd_rate = await get_usd_rate()
+    change = await with_db(partial(add_to_book, quantity=quantity),
+                           client_payout_addr, machine_app.PAYMENT_REQ,
+                           usd_rate, action == 'up')
+    return response('%d' % change)
+
+async def book_summary(request):
+    etag, body = live_book.summary_json()
+    return conditional(request, body, JSON, etag)
+
+async def show_book(request):
+    try:
+        after_id, limit, is_buy = machine_app.page_args(request.args)
+    except ValueError as e:
+        return response("Bad page: %s" % e, 400)
+    return 200, [(b'content-type', JSON)], \
+        stream_orders(after_id, limit, is_buy)
+
+async def stream_orders(after_id, limit, is_buy):
+    # the connection is held until the last chunk is sent
+    async with db_slots:
+        conn = await blocking(pool.acquire)
+        try:
+            chunks = dump_stream(iter_orders(conn, after_id, limit, is_buy))
+            while True:
+                batch = await blocking(
+                    lambda: ''.join(islice(chunks, STREAM_CHUNK)))
+                if not batch:
+                    return
+                yield batch.encode('utf-8')
+        finally:
+            pool.release(conn)
+
+async def docs(request):
+    '''
+    Serves the app manifest to the 21 crawler.
+    '''
+    body, etag, last_modified = await blocking(manifest.get)
+    return conditional(request, body, JSON, etag, last_modified)
+
+def read_client():
+    with open(os.path.join(STATIC, 'client.py'), 'rb') as f:
+        return f.read()
+
+async def client(request):
+    '''
+    Provides an example client script.
+    '''
+    return response(await blocking(read_client),
+                    content_type=b'text/x-python; charset=utf-8')
+
+ROUTES = {
+    '/btc_quote': btc_quote,
+    '/quote': price_quote,
+    '/quote/stats': quote_stats,
+    '/quote/stream': quote_stream,
+    '/buy': purchase,
+    '/book/summary': book_summary,
+    '/show': show_book,
+    '/manifest': docs,
+    '/client': client,
+}
+
+async def handle(request):
+    handler = ROUTES.get(request.path)
+    if handler is None:
+        return response("Not Found", 404)
+    if request.method not in ('GET', 'HEAD'):
+        return response("Method Not Allowed", 405)
+    try:
+        return await handler(request)
+    except PriceUnavailable:
+        return response("BTCUSD price unavailable, try again later", 503)
+    except Exception as e:
+        logging.exception("%s failed: %s" % (request.path, e))
+        return response("Internal Server Error", 500)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            pool.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    status, headers, body = await handle(Request(scope))
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': headers})
+    if isinstance(body, bytes):
+        await send({'type': 'http.response.body', 'body': body})
+        return
+    async for chunk in body:
+        await send({'type': 'http.response.body', 'body': chunk,
+                    'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=PORT)
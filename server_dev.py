@@ -6,31 +6,28 @@ import json
 import requests
 import logging
 
-import sqlite3
-from flask import g
-
 # import flask web microframework
 from flask import Flask
 from flask import request
+from flask import Response, stream_with_context
 
 # vending machine stuff
-from orderbook import add_to_book, get_order_book, get_book_quote
+from orderbook import add_to_book, live_book, QuoteCache
+from orderbook import iter_orders, dump_stream
 import machine_app
+import db
 
 DATABASE = "book.db"
 
-def get_db(app):
-    with app.app_context():
-        db = getattr(g, '_database', None)
-        if db is None:
-            db = g._database = connect_to_database()
-        return db
-        
-def connect_to_database():
-    return sqlite3.connect(DATABASE)
+app = machine_app.vending_machine(DATABASE)
+pool = db.init_app(app, DATABASE)
+with pool.connection() as conn:
+    live_book.load(conn)
+
+def render_quote(q, buy_price, sell_price):
+    return 'buy: %.5f, sell: %.5f' % (buy_price, sell_price)
 
-app = machine_app.vending_machine()
-conn = get_db(app)
+quote_cache = QuoteCache(render_quote)
 
 # fetch current bitcoin price
 @app.route('/btc_quote')
@@ -42,9 +39,23 @@ def btc_quote():
 @app.route('/quote')
 def price_quote():
     logging.info("quote")
+    try:
+        quantity = machine_app.quantity_arg(request.args)
+    except ValueError as e:
+        return "Bad quantity: %s" % e, 400
     q = machine_app.get_quote()
-    buy_price, sell_price = get_book_quote(conn, q)
-    return 'buy: %.5f, sell: %.5f' % (buy_price, sell_price)
+    return quote_cache.get(q, quantity=quantity)
+
+# push a quote event whenever the book or BTCUSD moves
+@app.route('/quote/stream')
+def quote_stream():
+    return Response(machine_app.quote_broadcaster.subscribe(),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/quote/stats')
+def quote_stats():
+    return json.dumps(quote_cache.stats())
 
 # buy a bitcoin option - require payment at max price, return the change
 @app.route('/buy')
@@ -53,20 +64,35 @@ def purchase():
     client_payout_addr = request.args.get('payout_address')
     # price movement: up or down
     action = request.args.get('action')
+    try:
+        quantity = machine_app.quantity_arg(request.args)
+    except ValueError as e:
+        return "Bad quantity: %s" % e, 400
 
     usd_rate = machine_app.get_quote()
 
     # add to book
-    if action == 'up':
-        change = add_to_book(conn, client_payout_addr, machine_app.PAYMENT_REQ, usd_rate, True)
-    else:
-        change = add_to_book(conn, client_payout_addr, machine_app.PAYMENT_REQ, usd_rate, False)
+    change = add_to_book(db.get_db(), client_payout_addr, machine_app.PAYMENT_REQ,
+                         usd_rate, action == 'up', quantity=quantity)
     return '%d' % change
 
+@app.route('/book/summary')
+def book_summary():
+    live_book.ensure_loaded(db.get_db())
+    etag, body = live_book.summary_json()
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
 @app.route('/show')
 def show_book():
-    book = get_order_book(conn)
-    return json.dumps(book.dump_all())
+    try:
+        after_id, limit, is_buy = machine_app.page_args(request.args)
+    except ValueError as e:
+        return "Bad page: %s" % e, 400
+    orders = iter_orders(db.get_db(), after_id, limit, is_buy)
+    return Response(stream_with_context(dump_stream(orders)),
+                    mimetype='application/json')
 
 if __name__ == '__main__':
     app.run()
\ No newline at end of file
@@ -0,0 +1,9 @@
+"""  Stand-ins for the 21 wallet, payment layer and price sources
+
+machine_app uses these instead of two1 and the live BTCUSD feeds when
+VENDING_OFFLINE=1, so the servers run and can be load tested on a box
+with neither a 21 wallet nor network access.
+"""
+from standin.wallet import Wallet
+from standin.payment import Payment
+from standin.price import StaticPriceSource
@@ -0,0 +1,29 @@
+"""  Stand-in payment layer
+
+Takes the place of two1.lib.bitserv.flask.Payment. required() prices the
+request the same way, with a fixed price or a callable, and then lets
+it through as if it had been paid. The amounts are added to `charged`.
+"""
+import threading
+from functools import wraps
+
+class Payment(object):
+
+    def __init__(self, app, wallet):
+        self.app = app
+        self.wallet = wallet
+        self.lock = threading.Lock()
+        self.payments = 0
+        self.charged = 0  # satoshis
+
+    def required(self, price, **kwargs):
+        def decorator(fn):
+            @wraps(fn)
+            def paid(*args, **kw):
+                amount = price(*args, **kw) if callable(price) else price
+                with self.lock:
+                    self.payments += 1
+                    self.charged += amount
+                return fn(*args, **kw)
+            return paid
+        return decorator
@@ -0,0 +1,18 @@
+"""  Stand-in BTCUSD source
+
+A price source (anything with a fetch()) that needs no network. It
+returns `rate`, moved by up to `jitter` USD each fetch so quotes still
+change the way live ones do.
+"""
+import random
+
+class StaticPriceSource(object):
+
+    def __init__(self, rate=400.0, jitter=0.0):
+        self.rate = rate
+        self.jitter = jitter
+
+    def fetch(self):
+        if not self.jitter:
+            return self.rate
+        return self.rate + random.uniform(-self.jitter, self.jitter)
@@ -0,0 +1,27 @@
+"""  Stand-in wallet
+
+Same calls as the two1 Wallet that the vending machine makes. Every send
+succeeds at once with a made-up txid and is kept in `sent`.
+"""
+import hashlib
+import threading
+
+PAYOUT_ADDRESS = '1StandinPayoutAddressXXXXXXXXXXXX'
+
+class Wallet(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = []  # (txid, {address: amount})
+
+    def get_payout_address(self):
+        return PAYOUT_ADDRESS
+
+    def send_to(self, address, amount):
+        return self.send_to_multiple({address: amount})
+
+    def send_to_multiple(self, addresses_and_amounts):
+        with self.lock:
+            txid = hashlib.sha256(b'standin %d' % len(self.sent)).hexdigest()
+            self.sent.append((txid, dict(addresses_and_amounts)))
+        return [{"txid": txid}]
@@ -25,19 +25,23 @@ def cmd_price_quote():
     r = requests.get(url)
     print(r.text)
 
-def cmd_buy(action):
-    url = SERVER_URL + 'buy?action=%s&payout_address=%s' % \
-                        (action, wallet.get_payout_address())
+def cmd_buy(action, quantity=1):
+    # lock a price first; /buy charges exactly that
+    r = requests.get(SERVER_URL + 'quote/lock?action=%s&quantity=%d' %
+                     (action, quantity))
+    lock = r.json()
+    url = SERVER_URL + 'buy?action=%s&quantity=%d&payout_address=%s&lock=%s' % \
+                        (action, quantity, wallet.get_payout_address(), lock['lock'])
     r = requests.get(url)
     print(r.text)
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
-        "Usage: client.py buy <up/down>"
+        "Usage: client.py buy <up/down> [quantity]"
         cmd_price_quote()
     elif sys.argv[1] == 'quote':
         cmd_price_quote()
     elif sys.argv[1] == 'buy':
-        cmd_buy(sys.argv[2])
+        cmd_buy(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 1)
     else:
         cmd_price_quote()
@@ -0,0 +1,74 @@
+""" Durable /buy inserts under concurrency: one fsync'd transaction per
+    order vs the group-commit OrderWriter, then full sequenced fills
+    (price + insert through add_to_book)
+
+    python3 test/buy_bench.py [orders per thread]
+"""
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tempfile
+import threading
+import time
+
+import db
+from orderbook import Order, add_order_book, add_to_book, live_book, order_writer
+
+def percentile(latencies, p):
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))]
+
+def insert(conn):
+    add_order_book(conn, Order(True, "blah", 400, 999))
+
+def fill(conn):
+    add_to_book(conn, "blah", 10000, 400, True)
+
+def run(pool, threads, n, request=insert):
+    latencies = []
+    lock = threading.Lock()
+    def worker():
+        mine = []
+        with pool.connection() as conn:
+            conn.execute("PRAGMA synchronous=FULL")
+            for _ in range(n):
+                start = time.perf_counter()
+                request(conn)
+                mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return (len(latencies) / elapsed, percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000)
+
+def main(n):
+    print("%8s %8s %12s %10s %10s" % ("threads", "mode", "orders/s", "p50 ms", "p99 ms"))
+    for threads in [1, 8, 32, 64]:
+        for mode in ["direct", "group", "fill"]:
+            with tempfile.TemporaryDirectory() as tmp:
+                database = os.path.join(tmp, "bench.db")
+                pool = db.ConnectionPool(database, size=threads)
+                with pool.connection() as conn:
+                    db.migrate(conn)
+                    live_book.load(conn)
+                if mode != "direct":
+                    order_writer.start(lambda: db.connect(database))
+                try:
+                    result = run(pool, threads, n,
+                                 fill if mode == "fill" else insert)
+                    if mode == "fill":
+                        with pool.connection() as conn:
+                            assert live_book.check(conn)
+                finally:
+                    order_writer.stop()
+                    pool.close()
+            print("%8d %8s %12.0f %10.2f %10.2f" % ((threads, mode) + result))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
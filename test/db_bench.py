@@ -0,0 +1,66 @@
+""" /buy + /show throughput under concurrency: one shared connection in
+    rollback-journal mode (the old server) vs the WAL connection pool
+
+    python3 test/db_bench.py [requests]
+"""
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import tempfile
+import threading
+import time
+from random import random, uniform
+from contextlib import contextmanager
+
+import db
+from orderbook import add_to_book, get_order_book, live_book
+
+class SharedConnection(object):
+    """ the old model: every thread funnels through one connection
+    """
+    def __init__(self, database):
+        self.conn = sqlite3.connect(database, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        with self.lock:
+            yield self.conn
+
+def request(pool):
+    with pool.connection() as conn:
+        if random() < 0.5:
+            add_to_book(conn, "blah", 10000, uniform(300, 500), random() < 0.5)
+        else:
+            get_order_book(conn, uniform(300, 500)).get_quote(True)
+
+def run(pool, threads, n):
+    def worker():
+        for _ in range(n // threads):
+            request(pool)
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return n // threads * threads / (time.perf_counter() - start)
+
+def main(n):
+    print("%8s %14s %14s" % ("threads", "shared req/s", "pool req/s"))
+    for threads in [1, 4, 16]:
+        rates = []
+        for make in [SharedConnection, db.ConnectionPool]:
+            with tempfile.TemporaryDirectory() as tmp:
+                database = os.path.join(tmp, "bench.db")
+                conn = sqlite3.connect(database)
+                db.migrate(conn)
+                conn.close()
+                live_book.loaded = False
+                rates.append(run(make(database), threads, n))
+        print("%8d %14.0f %14.0f" % (threads, rates[0], rates[1]))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1600)
@@ -0,0 +1,111 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import tempfile
+import threading
+import unittest
+from flask import Flask
+from db import *
+
+LEGACY_SCHEMA = """CREATE TABLE orders (
+    id                  INTEGER PRIMARY KEY,
+    created_at          DATETIME DEFAULT CURRENT_TIMESTAMP,
+    is_buy              INTEGER NOT NULL,
+    payout_address      TEXT NOT NULL,
+    usd_rate            REAL NOT NULL,
+    price               INTEGER NOT NULL
+);"""
+
+class TestMigrate(unittest.TestCase):
+
+  def test_archives_expired(self):
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(LEGACY_SCHEMA)
+    for is_buy in [1, 0, -1, -1]:
+      conn.execute("INSERT INTO orders(is_buy, payout_address, usd_rate, price) \
+        VALUES (?, 'blah', 400, 999)", (is_buy,))
+    migrate(conn)
+    migrate(conn)
+    live = conn.execute("SELECT count(*) FROM orders").fetchone()[0]
+    archived = conn.execute("SELECT count(*) FROM orders_archive").fetchone()[0]
+    self.assertEqual((live, archived), (2, 2))
+    owed = conn.execute("SELECT count(*) FROM orders_archive WHERE payout_id IS NULL").fetchone()[0]
+    self.assertEqual(owed, 0)
+    indexes = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+    self.assertIn('orders_side_created', indexes)
+    self.assertIn('orders_side_rate', indexes)
+
+  def test_autoincrement(self):
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(LEGACY_SCHEMA)
+    for is_buy in [1, -1, -1]:
+      conn.execute("INSERT INTO orders(is_buy, payout_address, usd_rate, price) \
+        VALUES (?, 'blah', 400, 999)", (is_buy,))
+    migrate(conn)
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'orders'").fetchone()[0]
+    self.assertIn('AUTOINCREMENT', sql)
+    self.assertEqual(conn.execute("SELECT id FROM orders").fetchall(), [(1,)])
+    # the archived ids 2 and 3 are not handed out again
+    conn.execute("INSERT INTO orders(is_buy, payout_address, usd_rate, price) \
+      VALUES (0, 'blah', 400, 999)")
+    self.assertEqual(conn.execute("SELECT max(id) FROM orders").fetchone()[0], 4)
+    migrate(conn)
+    self.assertEqual(conn.execute("SELECT count(*) FROM orders").fetchone()[0], 2)
+
+class TestConnectionPool(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.database = os.path.join(self.tmp.name, 'book.db')
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_wal(self):
+    conn = connect(self.database)
+    self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+    self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+    conn.close()
+
+  def test_reuse(self):
+    pool = ConnectionPool(self.database, size=2)
+    with pool.connection() as conn:
+      conn.execute("CREATE TABLE t (x)")
+      conn.execute("INSERT INTO t VALUES (1)")
+    with pool.connection() as again:
+      self.assertIs(again, conn)
+      self.assertEqual(again.execute("SELECT count(*) FROM t").fetchone()[0], 0)
+    pool.close()
+
+  def test_threads(self):
+    pool = ConnectionPool(self.database, size=2)
+    with pool.connection() as conn:
+      migrate(conn)
+    def insert():
+      for _ in range(20):
+        with pool.connection() as conn:
+          with conn:
+            conn.execute("INSERT INTO orders(is_buy, payout_address, usd_rate, price) \
+              VALUES (1, 'blah', 400, 999)")
+    threads = [threading.Thread(target=insert) for _ in range(4)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    with pool.connection() as conn:
+      self.assertEqual(conn.execute("SELECT count(*) FROM orders").fetchone()[0], 80)
+    pool.close()
+
+  def test_flask(self):
+    app = Flask(__name__)
+    pool = init_app(app, self.database)
+    with app.app_context():
+      conn = get_db()
+      self.assertIs(get_db(), conn)
+    with app.app_context():
+      self.assertIs(get_db(), conn)
+    pool.close()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,135 @@
+""" Offline load test of the vending API: drives /quote, /buy and /show
+    at a fixed concurrency and reports throughput and p50/p95/p99 per
+    route. Without --url it starts server.py (or --server server_dev) in
+    process on a scratch database, with VENDING_OFFLINE=1 so the wallet,
+    payments and BTCUSD feed are the stand-ins; with --url it drives a
+    server already running (e.g. server_async under uvicorn).
+
+    python3 test/load_bench.py [--clients 32] [--seconds 10]
+        [--mix quote=8,buy=1,show=1] [--server server] [--url URL]
+"""
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import logging
+import random
+import tempfile
+import threading
+import time
+
+import requests
+
+def percentile(latencies, p):
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))]
+
+def start_server(module):
+    """ import the server on a scratch database and serve it on a free
+        port; returns (base url, server)
+    """
+    os.environ['VENDING_OFFLINE'] = '1'
+    os.chdir(tempfile.mkdtemp())  # the servers open book.db in the cwd
+    from werkzeug.serving import make_server
+    app = __import__(module).app
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:%d' % server.server_port, server
+
+class Client(object):
+
+    def __init__(self, base, locks):
+        self.base = base
+        self.locks = locks  # /buy wants a price lock (server.py)
+        self.session = requests.Session()
+        self.latencies = {}
+        self.errors = {}
+
+    def get(self, route, path):
+        start = time.perf_counter()
+        try:
+            r = self.session.get(self.base + path, timeout=30)
+            ok = r.status_code < 400
+        except requests.RequestException:
+            r, ok = None, False
+        self.latencies.setdefault(route, []).append(time.perf_counter() - start)
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+        return r if ok else None
+
+    def quote(self):
+        self.get('/quote', '/quote')
+
+    def buy(self):
+        action = random.choice(['up', 'down'])
+        address = 'load%d' % random.randint(0, 999)
+        path = '/buy?action=%s&payout_address=%s' % (action, address)
+        if self.locks:
+            r = self.get('/quote/lock', '/quote/lock?action=%s' % action)
+            if r is None:
+                return
+            path += '&lock=' + r.json()['lock']
+        self.get('/buy', path)
+
+    def show(self):
+        self.get('/show', '/show?limit=100')
+
+def run(base, clients, seconds, mix):
+    locks = requests.get(base + '/quote/lock?action=up').status_code == 200
+    ops = [op for op, weight in mix for _ in range(weight)]
+    workers = [Client(base, locks) for _ in range(clients)]
+    deadline = time.perf_counter() + seconds
+    def work(client):
+        while time.perf_counter() < deadline:
+            getattr(client, random.choice(ops))()
+    threads = [threading.Thread(target=work, args=(c,)) for c in workers]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies = {}
+    errors = {}
+    for c in workers:
+        for route, l in c.latencies.items():
+            latencies.setdefault(route, []).extend(l)
+        for route, n in c.errors.items():
+            errors[route] = errors.get(route, 0) + n
+    return elapsed, latencies, errors
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--mix', default='quote=8,buy=1,show=1')
+    parser.add_argument('--server', default='server')
+    parser.add_argument('--url')
+    args = parser.parse_args()
+    mix = [(op, int(weight)) for op, weight in
+           (pair.split('=') for pair in args.mix.split(','))]
+
+    server = None
+    base = args.url.rstrip('/') if args.url else None
+    if base is None:
+        base, server = start_server(args.server)
+    try:
+        elapsed, latencies, errors = run(base, args.clients, args.seconds, mix)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print("%d clients, %.1fs against %s" % (args.clients, elapsed, base))
+    print("%-12s %8s %10s %10s %10s %10s %8s" % ("route", "requests", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors"))
+    total = 0
+    for route in sorted(latencies):
+        l = latencies[route]
+        total += len(l)
+        print("%-12s %8d %10.0f %10.2f %10.2f %10.2f %8d" % (route, len(l), len(l) / elapsed,
+              percentile(l, 50) * 1000, percentile(l, 95) * 1000,
+              percentile(l, 99) * 1000, errors.get(route, 0)))
+    print("%-12s %8d %10.0f" % ("total", total, total / elapsed))
+
+if __name__ == '__main__':
+    main()
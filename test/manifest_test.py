@@ -0,0 +1,51 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import tempfile
+import unittest
+from manifest import *
+
+class TestManifest(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.path = tempfile.mkstemp(suffix='.yaml')
+    os.close(fd)
+    self.write("info:\n  title: Binary Options\n", 1000000000)
+
+  def tearDown(self):
+    os.remove(self.path)
+
+  def write(self, text, mtime):
+    with open(self.path, 'w') as f:
+      f.write(text)
+    os.utime(self.path, (mtime, mtime))
+
+  def test_cached(self):
+    manifest = Manifest(self.path)
+    body, etag, last_modified = manifest.get()
+    self.assertEqual(json.loads(body.decode('utf-8')), {"info": {"title": "Binary Options"}})
+    self.assertEqual(last_modified.timestamp(), 1000000000)
+    self.assertIs(manifest.get()[0], body)
+
+  def test_reloads_on_change(self):
+    manifest = Manifest(self.path)
+    body, etag, _ = manifest.get()
+    self.write("info:\n  title: Binary Options 2\n", 1000000060)
+    body2, etag2, last_modified = manifest.get()
+    self.assertNotEqual(etag2, etag)
+    self.assertEqual(json.loads(body2.decode('utf-8'))["info"]["title"], "Binary Options 2")
+    self.assertEqual(last_modified.timestamp(), 1000000060)
+
+  def test_repo_manifest(self):
+    body, _, _ = Manifest().get()
+    spec = json.loads(body.decode('utf-8'))
+    self.assertEqual(spec["swagger"], "2.0")
+    self.assertIn("/quote/lock", spec["paths"])
+    buy = [p["name"] for p in spec["paths"]["/buy"]["get"]["parameters"]]
+    self.assertEqual(sorted(buy), ["action", "lock", "payout_address", "quantity"])
+    # 100 options at up to 10000 satoshis each
+    self.assertEqual(spec["info"]["x-21-total-price"]["max"], 100 * 10000)
+
+if __name__ == '__main__':
+  unittest.main()
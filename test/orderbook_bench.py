@@ -0,0 +1,62 @@
+""" Memory and build time of a 1M-order book: Order objects with a
+    __dict__ (the old class), Order with __slots__, and ColumnarOrderBook
+
+    python3 test/orderbook_bench.py [orders]
+"""
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import tracemalloc
+from datetime import datetime
+from random import randint, uniform
+
+from orderbook import ColumnarOrderBook, Order, OrderBook
+
+class DictOrder(object):
+    def __init__(self, is_buy, payout_address, usd_rate, price, created_at=None):
+        self.is_buy = is_buy
+        self.payout_address = payout_address
+        self.usd_rate = usd_rate
+        self.price = price
+        self.created_at = created_at
+
+def objects(cls, rows):
+    return OrderBook([cls(s, a, r, p, datetime.utcfromtimestamp(c))
+                      for s, a, r, p, c in rows])
+
+def columns(rows):
+    book = ColumnarOrderBook()
+    for row in rows:
+        book.append(*row)
+    return book
+
+def measure(build, rows):
+    tracemalloc.start()
+    start = time.perf_counter()
+    book = build(rows)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return book, elapsed, size
+
+def main(n):
+    now = int(time.time())
+    rows = [(randint(0, 1), "1Addr%d" % randint(0, n // 10), uniform(300, 500),
+             randint(1, 10000), now - randint(0, 86400)) for _ in range(n)]
+    print("%-10s %10s %12s %10s %10s" % ("book", "build s", "MB", "B/order", "quote s"))
+    for name, build in [("dict", lambda r: objects(DictOrder, r)),
+                        ("slots", lambda r: objects(Order, r)),
+                        ("columnar", columns)]:
+        book, elapsed, size = measure(build, rows)
+        quote = float('nan')
+        if name != "dict":  # DictOrder has no weight()
+            start = time.perf_counter()
+            book.get_quote(True)
+            quote = time.perf_counter() - start
+        del book
+        print("%-10s %10.2f %12.1f %10.1f %10.3f" % (name, elapsed, size / 2**20,
+                                                     float(size) / n, quote))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
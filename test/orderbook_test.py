@@ -0,0 +1,372 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import calendar
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import db
+from orderbook import *
+
+from datetime import datetime, timedelta
+from random import randint, choice
+
+def make_db():
+  conn = sqlite3.connect(':memory:')
+  db.migrate(conn)
+  return conn
+
+class TestLiveBook(unittest.TestCase):
+
+  def setUp(self):
+    self.conn = make_db()
+    now = datetime.utcnow().replace(microsecond=0)
+    for _ in range(50):
+      created_at = now - timedelta(minutes=randint(0, 24*60))
+      add_order_book(self.conn, Order(choice([True, False]), "blah", randint(300, 500), 999, created_at))
+    self.book = LiveBook()
+    self.book.load(self.conn)
+
+  def test_matches_order_book(self):
+    now = time.time()
+    for usd_rate in [None, 250, 400, 400.5, 600]:
+      book = get_order_book(self.conn, usd_rate)
+      self.assertEqual(self.book.net_options_out(usd_rate), book.net_options_out())
+      self.assertAlmostEqual(self.book.get_quote(True, usd_rate, now), book.get_quote(True, now))
+      self.assertAlmostEqual(self.book.get_quote(False, usd_rate, now), book.get_quote(False, now))
+
+  def test_strike_sums(self):
+    now = datetime.utcnow().replace(microsecond=0)
+    # several strikes within one cent, either side of the quoted ones
+    added = [Order(choice([True, False]), "cent", rate, 999, now - timedelta(minutes=randint(0, 60)))
+             for rate in [400.001, 400.004, 400.005, 400.005, 400.009, 400.01, 399.999]]
+    for order in added:
+      add_order_book(self.conn, order)
+      self.book.add(order)
+    t = calendar.timegm(now.utctimetuple())
+    def assertMatches():
+      for usd_rate in [300, 399.999, 400, 400.004, 400.005, 400.0051, 400.01, 500]:
+        book = get_order_book(self.conn, usd_rate)
+        self.assertEqual(self.book.net_options_out(usd_rate), book.net_options_out())
+        for got, expected in zip(self.book.weighted_options_out(usd_rate, t), book.weighted_options_out(t)):
+          self.assertAlmostEqual(got, expected)
+    assertMatches()
+    self.book.remove(added[2:5])
+    self.conn.execute("DELETE FROM orders WHERE usd_rate IN (400.005, 400.009)")
+    assertMatches()
+    self.book.expire(t + 3600)
+    self.conn.execute("DELETE FROM orders WHERE CAST(strftime('%s', created_at) AS INTEGER) <= ?",
+                      (t + 3600 - EXPIRY_SECONDS,))
+    assertMatches()
+    self.assertTrue(self.book.check(self.conn))
+
+  def test_time_weighting(self):
+    now = time.time()
+    num_buys, num_sells = self.book.net_options_out()
+    buys, sells = self.book.weighted_options_out(now=now)
+    self.assertLessEqual(buys, num_buys)
+    self.assertLessEqual(sells, num_sells)
+    later = self.book.weighted_options_out(now=now + 3600)
+    self.assertLess(later[0], buys)
+    self.assertEqual(self.book.weighted_options_out(now=now + 2*24*3600), (0.0, 0.0))
+    order = Order(True, "blah", 450, 999, datetime.utcnow())
+    self.book.add(order)
+    self.assertAlmostEqual(self.book.weighted_options_out(now=now)[0], buys + 1, places=2)
+
+  def test_expired_unsettled(self):
+    conn = make_db()
+    now = datetime.utcnow().replace(microsecond=0)
+    for hours in [36, 36, 1, 1]:
+      add_order_book(conn, Order(True, "blah", 400, 999, now - timedelta(hours=hours)))
+    book = LiveBook()
+    book.load(conn)
+    t = calendar.timegm(now.utctimetuple())
+    buys, sells = book.weighted_options_out(now=t)
+    self.assertAlmostEqual(buys, 2 * 23 / 24.)
+    self.assertAlmostEqual(buys, get_order_book(conn).weighted_options_out(t)[0])
+    self.assertAlmostEqual(buys, get_columnar_book(conn).weighted_options_out(t)[0])
+    self.assertAlmostEqual(book.weighted_options_out(350, t)[0], buys)
+    book.add(Order(True, "blah", 400, 999, now))
+    self.assertAlmostEqual(book.weighted_options_out(now=t)[0], buys + 1)
+    # settled: nothing left to skip
+    book.expire(t)
+    self.assertAlmostEqual(book.weighted_options_out(now=t)[0], buys + 1)
+    self.assertEqual(book.net_options_out(), (3, 0))
+
+  def test_add_and_remove(self):
+    num_buys, num_sells = self.book.net_options_out()
+    order = Order(True, "blah", 450, 999, datetime.utcnow())
+    self.book.add(order)
+    self.assertEqual(self.book.net_options_out(), (num_buys+1, num_sells))
+    self.book.remove([order])
+    self.assertEqual(self.book.net_options_out(), (num_buys, num_sells))
+
+  def test_concurrent_fills(self):
+    prices = []
+    def buy():
+      for _ in range(5):
+        prices.append(self.book.fill(True, "blah", 250, 10000).price)
+    threads = [threading.Thread(target=buy) for _ in range(8)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    # every fill paid for all the fills before it
+    self.assertEqual(len(set(prices)), 40)
+    num_buys, _ = self.book.net_options_out()
+    self.assertEqual(num_buys, len(get_order_book(self.conn).buys()) + 40)
+
+  def test_locked_price(self):
+    order = self.book.fill(True, "blah", 250, 10000, price=1234)
+    self.assertEqual(order.price, 1234)
+    self.assertEqual(self.book.net_options_out(250)[0], len(get_order_book(self.conn, 250).buys()) + 1)
+
+  def test_multi_unit(self):
+    num_buys, _ = self.book.net_options_out()
+    total = int(round(self.book.get_quote(True, 250, quantity=7) * 10000))
+    write_orders(self.conn, self.book.fill_many(True, "many", 250, 10000, 7))
+    rows = self.conn.execute("SELECT price FROM orders WHERE payout_address = 'many'").fetchall()
+    self.assertEqual(len(rows), 7)
+    self.assertEqual(sum(p for (p,) in rows), total)
+    self.assertEqual(self.book.net_options_out()[0], num_buys + 7)
+    self.assertEqual(split_price(100, 7), [15, 15, 14, 14, 14, 14, 14])
+
+  def test_check(self):
+    self.assertTrue(self.book.check(self.conn))
+    self.book.add(Order(False, "blah", 450, 999, datetime.utcnow()))
+    self.assertFalse(self.book.check(self.conn))
+
+class TestSummary(unittest.TestCase):
+
+  def setUp(self):
+    self.conn = make_db()
+    now = datetime.utcnow().replace(microsecond=0)
+    for _ in range(50):
+      created_at = now - timedelta(minutes=randint(0, 23*60))
+      add_order_book(self.conn, Order(choice([True, False]), "blah", randint(300, 500), randint(1, 999), created_at))
+    self.book = LiveBook()
+    self.book.load(self.conn)
+
+  def assertMatchesTable(self, now):
+    summary = self.book.summary(now)
+    book = get_order_book(self.conn)
+    for name, orders in (('up', book.buys()), ('down', book.sells())):
+      side = summary["sides"][name]
+      self.assertEqual(side["count"], len(orders))
+      self.assertEqual(side["notional"], sum(o.price for o in orders))
+      strikes = {}
+      for o in orders:
+        strike = int(o.usd_rate // STRIKE_BUCKET) * STRIKE_BUCKET
+        strikes[strike] = strikes.get(strike, 0) + 1
+      self.assertEqual({b["strike"]: b["count"] for b in side["by_strike"]}, strikes)
+      self.assertEqual(sum(b["count"] for b in side["by_expiry"]), len(orders))
+      for b in side["by_expiry"]:
+        self.assertTrue(0 <= b["hours"] <= 24)
+
+  def test_incremental(self):
+    now = time.time()
+    self.assertMatchesTable(now)
+    order = Order(True, "extra", 450, 999, datetime.utcnow().replace(microsecond=0))
+    add_order_book(self.conn, order)
+    self.book.add(order)
+    self.assertMatchesTable(now)
+    until = int(now) - 12*3600 + EXPIRY_SECONDS
+    self.conn.execute("DELETE FROM orders WHERE CAST(strftime('%s', created_at) AS INTEGER) <= ?",
+                      (until - EXPIRY_SECONDS,))
+    self.book.expire(until)
+    self.assertMatchesTable(now)
+    self.book.remove([order])
+    self.conn.execute("DELETE FROM orders WHERE payout_address = 'extra'")
+    self.assertMatchesTable(now)
+
+  def test_etag(self):
+    now = time.time()
+    etag, body = self.book.summary_json(now)
+    self.assertIs(self.book.summary_json(now)[1], body)
+    self.assertEqual(json.loads(body.decode('utf-8'))["version"], self.book.version)
+    self.assertNotEqual(self.book.summary_json(now + 3600)[0], etag)
+    self.book.add(Order(False, "blah", 450, 999, datetime.utcnow()))
+    self.assertNotEqual(self.book.summary_json(now)[0], etag)
+    # after a restart the version counts from 0 again: a different book
+    # at the same version is still a different ETag, the same one isn't
+    restarted = LiveBook()
+    restarted.load(self.conn)
+    self.assertEqual(restarted.summary_json(now)[0], etag)
+    restarted.version = self.book.version
+    self.assertNotEqual(restarted.summary_json(now)[0], self.book.summary_json(now)[0])
+
+class TestQuoteCache(unittest.TestCase):
+
+  def setUp(self):
+    self.book = LiveBook()
+    self.book.load(make_db())
+    self.cache = QuoteCache(lambda q, buy, sell: (q, buy, sell), self.book)
+
+  def test_hits_and_misses(self):
+    now = time.time()
+    quote = self.cache.get(400.0, now)
+    self.assertEqual(quote, (400.0, self.book.get_quote(True, None, now), self.book.get_quote(False, None, now)))
+    self.assertIs(self.cache.get(400.0, now), quote)
+    self.assertEqual(self.cache.stats()["hits"], 1)
+    # a new price tick, a new time tick and a book change all miss
+    self.cache.get(401.0, now)
+    self.cache.get(401.0, now + 1)
+    self.book.add(Order(True, "blah", 450, 999, datetime.utcnow()))
+    self.assertGreater(self.cache.get(401.0, now + 1)[1], quote[1])
+    self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 4, "hit_rate": 0.2})
+
+class TestColumnarOrderBook(unittest.TestCase):
+
+  def setUp(self):
+    self.conn = make_db()
+    now = datetime.utcnow().replace(microsecond=0)
+    for i in range(50):
+      created_at = now - timedelta(minutes=randint(0, 25*60))
+      add_order_book(self.conn, Order(choice([True, False]), "addr%d" % (i % 7), randint(300, 500), 999, created_at))
+
+  def test_matches_order_book(self):
+    now = time.time()
+    book = get_order_book(self.conn)
+    columns = get_columnar_book(self.conn)
+    self.assertEqual(len(columns), 50)
+    self.assertEqual(len(columns.addresses), 7)
+    self.assertEqual(columns.net_options_out(), book.net_options_out())
+    for a, b in zip(columns.weighted_options_out(now), book.weighted_options_out(now)):
+      self.assertAlmostEqual(a, b)
+    self.assertAlmostEqual(columns.get_quote(True, now), book.get_quote(True, now))
+    self.assertEqual(columns.dump_all(), book.dump_all())
+    self.assertEqual(columns.top_of_book().to_json(), book.top_of_book().to_json())
+
+  def test_slots(self):
+    self.assertFalse(hasattr(Order(True, "blah", 400, 999), '__dict__'))
+
+class TestPaging(unittest.TestCase):
+
+  def setUp(self):
+    self.conn = make_db()
+    now = datetime.utcnow().replace(microsecond=0)
+    for i in range(30):
+      add_order_book(self.conn, Order(i % 3 == 0, "addr%d" % i, 400, 999, now))
+
+  def test_pages(self):
+    seen = []
+    after_id = 0
+    while True:
+      page = list(iter_orders(self.conn, after_id, 7))
+      if not page:
+        break
+      self.assertLessEqual(len(page), 7)
+      seen.extend(page)
+      after_id = page[-1].id
+    self.assertEqual([o.payout_address for o in seen], ["addr%d" % i for i in range(30)])
+    self.assertEqual(len(list(iter_orders(self.conn, is_buy=1))), 10)
+    self.assertTrue(all(o.is_buy for o in iter_orders(self.conn, is_buy=1)))
+
+  def test_dump_stream(self):
+    orders = list(iter_orders(self.conn))
+    doc = json.loads(''.join(dump_stream(iter(orders))))
+    self.assertEqual(doc, [o.to_json() for o in orders])
+    self.assertEqual(doc[0]["id"], orders[0].id)
+    self.assertEqual(json.loads(''.join(dump_stream(iter([])))), [])
+
+class TestOrderWriter(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.database = os.path.join(self.tmp.name, 'book.db')
+    conn = db.connect(self.database)
+    db.migrate(conn)
+    conn.close()
+    self.writer = OrderWriter(interval=0.01)
+    self.writer.start(lambda: db.connect(self.database))
+
+  def tearDown(self):
+    self.writer.stop()
+    self.tmp.cleanup()
+
+  def test_group_commit(self):
+    def buy():
+      for _ in range(10):
+        self.writer.submit(Order(True, "blah", 400, 999, datetime.utcnow()))
+    threads = [threading.Thread(target=buy) for _ in range(8)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    conn = db.connect(self.database)
+    self.assertEqual(conn.execute("SELECT count(*) FROM orders").fetchone()[0], 80)
+    self.assertLess(self.writer.batches, 80)
+
+  def test_credits_change(self):
+    threads = [threading.Thread(target=self.writer.submit, args=(Order(True, "blah", 400, 999, datetime.utcnow()), 9001))
+               for _ in range(8)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    conn = db.connect(self.database)
+    self.assertEqual(conn.execute("SELECT amount FROM balances").fetchall(), [(8 * 9001,)])
+
+  def test_error(self):
+    errors = []
+    def buy(address):
+      try:
+        self.writer.submit(Order(True, address, 400, 999, datetime.utcnow()))
+      except sqlite3.IntegrityError as e:
+        errors.append(e)
+    threads = [threading.Thread(target=buy, args=(a,)) for a in ["blah", None, "blah"]]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(len(errors), 1)
+    conn = db.connect(self.database)
+    self.assertEqual(conn.execute("SELECT count(*) FROM orders").fetchone()[0], 2)
+
+  def test_failed_start(self):
+    connecting = threading.Event()
+    def connect():
+      connecting.wait()
+      raise sqlite3.OperationalError("unable to open database file")
+    writer = OrderWriter()
+    writer.start(connect)
+    errors = []
+    def buy():
+      try:
+        writer.submit(Order(True, "blah", 400, 999, datetime.utcnow()))
+      except WriterStopped as e:
+        errors.append(e)
+    t = threading.Thread(target=buy)
+    t.start()
+    while writer.queue.empty():
+      time.sleep(0.001)
+    # the queued order is failed, not left waiting, once the writer dies
+    connecting.set()
+    t.join(5)
+    self.assertFalse(t.is_alive())
+    self.assertEqual(len(errors), 1)
+    self.assertFalse(writer.running)
+    self.assertRaises(WriterStopped, writer.submit, Order(True, "blah", 400, 999, datetime.utcnow()))
+    writer.stop()
+
+  def test_fallback_is_durable(self):
+    self.writer.stop()
+    conn = db.connect(self.database)
+    statements = []
+    conn.set_trace_callback(statements.append)
+    write_orders(conn, [Order(True, "blah", 400, 999)])
+    self.assertLess(statements.index("PRAGMA synchronous=FULL"), statements.index("COMMIT"))
+    # the pooled connection goes back to NORMAL
+    self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+    self.assertEqual(conn.execute("SELECT count(*) FROM orders").fetchone()[0], 1)
+
+  def test_submit_after_stop(self):
+    self.writer.stop()
+    self.assertRaises(WriterStopped, self.writer.submit, Order(True, "blah", 400, 999, datetime.utcnow()))
+    self.assertTrue(self.writer.queue.empty())
+
+if __name__ == '__main__':
+  unittest.main()
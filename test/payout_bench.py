@@ -0,0 +1,82 @@
+""" Paying out an expiry window: one send_to per winner vs batched
+    multi-output transactions, against a wallet that sleeps per tx;
+    then settling a large window in one pass
+
+    python3 test/payout_bench.py [winners] [tx latency ms] [settled orders]
+"""
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from random import randint, uniform
+
+import db
+from orderbook import Order
+from payout import claim_expired, execute_payout, pay_claimed, winners
+
+class SlowWallet(object):
+    def __init__(self, latency):
+        self.latency = latency
+        self.txs = 0
+
+    def send_to(self, address, amount):
+        time.sleep(self.latency)
+        self.txs += 1
+        return [{"txid": "%064x" % self.txs}]
+
+    def send_to_multiple(self, addresses_and_amounts):
+        time.sleep(self.latency)
+        self.txs += 1
+        return [{"txid": "%064x" % self.txs}]
+
+def main(n, latency):
+    conn = sqlite3.connect(':memory:')
+    db.migrate(conn)
+    orders = [Order(True, "addr%d" % randint(0, n), 400, 999) for _ in range(n)]
+    conn.executemany("INSERT INTO orders(created_at, is_buy, payout_address, \
+        usd_rate, price) VALUES (datetime('now', '-25 hours'), ?, ?, ?, ?)",
+        ((o.is_buy, o.payout_address, o.usd_rate, o.price) for o in orders))
+    claim_expired(conn, int(time.time()), 450)
+
+    wallet = SlowWallet(latency)
+    start = time.perf_counter()
+    for o in winners(orders, 450):
+        wallet.send_to(o.payout_address, 1000)
+    print("%-10s %6d txs %10.3f s" % ("per-order", wallet.txs, time.perf_counter() - start))
+
+    for max_outputs in [25, 100, 250]:
+        conn.execute("UPDATE orders_archive SET payout_id = NULL")
+        wallet = SlowWallet(latency)
+        start = time.perf_counter()
+        pay_claimed(conn, wallet, 450, 1000, max_outputs)
+        print("%-10s %6d txs %10.3f s" % ("batch/%d" % max_outputs, wallet.txs,
+                                          time.perf_counter() - start))
+
+def settle(n):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        db.migrate(conn)
+        rows = ((randint(0, 1), "addr%d" % randint(0, n), uniform(300, 500), 999)
+                    for _ in range(n))
+        conn.executemany("INSERT INTO orders(created_at, is_buy, payout_address, \
+            usd_rate, price) VALUES (datetime('now', '-25 hours'), ?, ?, ?, ?)", rows)
+        conn.commit()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        execute_payout(conn, SlowWallet(0), 400, 1000)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        archived = conn.execute("SELECT count(*) FROM orders_archive").fetchone()[0]
+        print("settled %d orders in %.3f s, peak %.1f MB traced" %
+                (archived, elapsed, peak / 2**20))
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05
+    main(n, latency)
+    settle(int(sys.argv[3]) if len(sys.argv) > 3 else 100000)
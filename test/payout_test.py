@@ -2,8 +2,12 @@ import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import mock
+import sqlite3
+import time
 import unittest
+import db
 from payout import *
+from orderbook import write_order
 
 from random import randint
 
@@ -11,19 +15,135 @@ class MockWallet(object):
   def send_to(self, address, payout):
     pass
 
-def mock_execute_orders():
-  data = [[True,400],[True,500],[False,300],[False,500]]
-  return [Order(d[0], "blah", d[1], 999) for d in data]
+  def send_to_multiple(self, addresses_and_amounts):
+    pass
 
 class TestPayout(unittest.TestCase):
 
-  @mock.patch('payout.execute_orders', side_effect=mock_execute_orders)
+  def setUp(self):
+    self.conn = sqlite3.connect(':memory:')
+    db.migrate(self.conn)
+    self.wallet = mock.Mock(spec = MockWallet)
+    self.wallet.send_to_multiple.return_value = [{"txid": "abc"}]
+
+  def add_expired(self, data):
+    self.conn.executemany("INSERT INTO orders(created_at, is_buy, payout_address, usd_rate, price) \
+      VALUES (datetime('now', '-2 days'), ?, ?, ?, 999)", data)
+    self.conn.commit()
+
+  def owed(self):
+    return self.conn.execute("SELECT count(*) FROM orders_archive WHERE payout_id IS NULL").fetchone()[0]
+
   @mock.patch('payout.get_oldest', return_value='tomorrow')
-  def test_execute_payout(self, m0, m1):
-    wallet = mock.Mock(spec = MockWallet)
-    next_date = execute_payout(wallet, 450, 1000)
-    wallet.send_to.assert_called_with("blah", 1000)
+  def test_execute_payout(self, m0):
+    self.add_expired([(1, "blah", 400), (1, "blah", 500), (0, "blah", 300), (0, "blah", 500)])
+    next_date = execute_payout(self.conn, self.wallet, 450, 1000)
+    self.wallet.send_to_multiple.assert_called_once_with({"blah": 2000})
+    self.assertFalse(self.wallet.send_to.called)
     self.assertEqual(next_date, 'tomorrow')
-    
+    batches = self.conn.execute("SELECT txid, num_outputs, amount FROM payouts").fetchall()
+    self.assertEqual(batches, [("abc", 1, 2000)])
+    self.assertEqual(self.owed(), 0)
+
+  def test_max_outputs(self):
+    self.add_expired([(1, "addr%d" % randint(0, 9), 400) for _ in range(100)])
+    claim_expired(self.conn, int(time.time()), 450)
+    txids = pay_claimed(self.conn, self.wallet, 450, 1000, max_outputs=3, chunk=7)
+    self.assertEqual(len(txids), self.wallet.send_to_multiple.call_count)
+    paid = 0
+    for args, _ in self.wallet.send_to_multiple.call_args_list:
+      self.assertLessEqual(len(args[0]), 3)
+      paid += sum(args[0].values())
+    self.assertEqual(paid, 100 * 1000)
+
+  def test_failed_payout(self):
+    self.add_expired([(1, "a", 400), (1, "b", 400), (1, "c", 400), (0, "d", 400)])
+    self.wallet.send_to_multiple.side_effect = [
+      [{"txid": "tx1"}], IOError("wallet timed out"), [{"txid": "tx2"}], [{"txid": "tx3"}]]
+    self.assertRaises(IOError, execute_payout, self.conn, self.wallet, 450, 1000, 1)
+    # a was paid; b's batch may or may not have gone out; c is still owed
+    self.assertEqual(self.owed(), 1)
+    self.assertEqual(unconfirmed_batches(self.conn), [2])
+    execute_payout(self.conn, self.wallet, 460, 1000, 1)
+    self.assertEqual(self.owed(), 0)
+    sent = [args[0] for args, _ in self.wallet.send_to_multiple.call_args_list]
+    self.assertEqual(sent, [{"a": 1000}, {"b": 1000}, {"c": 1000}])
+    # b is not paid again until the batch is found never to have gone out
+    execute_payout(self.conn, self.wallet, 460, 1000, 1)
+    self.assertEqual(self.wallet.send_to_multiple.call_count, 3)
+    release_batch(self.conn, 2)
+    self.assertRaises(ValueError, release_batch, self.conn, 2)
+    self.assertEqual(self.owed(), 1)
+    execute_payout(self.conn, self.wallet, 460, 1000, 1)
+    self.wallet.send_to_multiple.assert_called_with({"b": 1000})
+    batches = self.conn.execute("SELECT txid FROM payouts ORDER BY id").fetchall()
+    self.assertEqual(batches, [("tx1",), ("tx2",), ("tx3",)])
+    self.assertEqual(unconfirmed_batches(self.conn), [])
+
+class TestSettlement(unittest.TestCase):
+
+  def setUp(self):
+    self.conn = sqlite3.connect(':memory:')
+    db.migrate(self.conn)
+    for age in ['-2 days', '-25 hours', '-1 day', '-23 hours', '-1 minute']:
+      self.conn.execute("INSERT INTO orders(created_at, is_buy, payout_address, usd_rate, price) \
+        VALUES (datetime('now', ?), 1, ?, 400, 999)", (age, age))
+    self.conn.commit()
+
+  def test_execute_orders(self):
+    orders = list(execute_orders(self.conn))
+    self.assertEqual(sorted(o.payout_address for o in orders), ['-1 day', '-2 days', '-25 hours'])
+    live = self.conn.execute("SELECT count(*) FROM orders").fetchone()[0]
+    archived = self.conn.execute("SELECT count(*) FROM orders_archive").fetchone()[0]
+    self.assertEqual((live, archived), (2, 3))
+    self.assertEqual(list(execute_orders(self.conn)), [])
+
+  def test_streams_in_chunks(self):
+    claim = claim_expired(self.conn, int(time.time()))
+    orders = list(iter_claimed(self.conn, claim, chunk=2))
+    self.assertEqual(len(orders), 3)
+
+  def test_drain_and_refill(self):
+    until = int(time.time()) + 2 * EXPIRY_SECONDS
+    self.assertEqual(len(list(execute_orders(self.conn, until))), 5)
+    # the book is empty; new orders must not reuse the archived ids
+    for _ in range(2):
+      self.conn.execute("INSERT INTO orders(created_at, is_buy, payout_address, usd_rate, price) \
+        VALUES (datetime('now', '-2 days'), 0, 'again', 400, 999)")
+    self.conn.commit()
+    self.assertEqual(len(list(execute_orders(self.conn))), 2)
+    archived = self.conn.execute("SELECT count(DISTINCT id) FROM orders_archive").fetchone()[0]
+    self.assertEqual(archived, 7)
+
+class TestChangeLedger(unittest.TestCase):
+
+  def setUp(self):
+    self.conn = sqlite3.connect(':memory:')
+    db.migrate(self.conn)
+    self.wallet = mock.Mock(spec = MockWallet)
+    self.wallet.send_to_multiple.return_value = [{"txid": "abc"}]
+    for address, change in [("a", 3000), ("b", 1000), ("a", 3000), ("c", 6000), ("d", 0)]:
+      write_order(self.conn, Order(True, address, 400, 10000 - change), change)
+
+  def balances(self):
+    return dict(self.conn.execute("SELECT payout_address, amount FROM balances").fetchall())
+
+  def test_credit(self):
+    self.assertEqual(self.balances(), {"a": 6000, "b": 1000, "c": 6000})
+    self.assertEqual(self.conn.execute("SELECT count(*) FROM orders").fetchone()[0], 5)
+
+  def test_sweep(self):
+    txids = sweep_balances(self.conn, self.wallet, 450, threshold=5000, max_outputs=1)
+    self.assertEqual(txids, ["abc", "abc"])
+    self.wallet.send_to_multiple.assert_any_call({"a": 6000})
+    self.wallet.send_to_multiple.assert_any_call({"c": 6000})
+    self.assertEqual(self.balances(), {"b": 1000})
+    self.assertEqual(sweep_balances(self.conn, self.wallet, 450, threshold=5000), [])
+
+  def test_failed_sweep(self):
+    self.wallet.send_to_multiple.side_effect = ValueError("dust")
+    self.assertRaises(ValueError, sweep_balances, self.conn, self.wallet, 450, 5000)
+    self.assertEqual(self.balances(), {"a": 6000, "b": 1000, "c": 6000})
+
 if __name__ == '__main__':
-  unittest.main()
\ No newline at end of file
+  unittest.main()
@@ -0,0 +1,85 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from price_feed import *
+from price_oracle import PriceSource
+
+class StubCoinDesk(BaseHTTPRequestHandler):
+  rate = 400.0
+  hits = 0
+  fail = False
+
+  def do_GET(self):
+    StubCoinDesk.hits += 1
+    if StubCoinDesk.fail:
+      self.send_response(503)
+      self.end_headers()
+      return
+    body = json.dumps({"bpi": {"USD": {"rate_float": StubCoinDesk.rate}}}).encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+class TestPriceFeed(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = HTTPServer(('127.0.0.1', 0), StubCoinDesk)
+    cls.source = PriceSource('stub', 'http://127.0.0.1:%d/' % cls.server.server_port,
+      ['bpi', 'USD', 'rate_float'])
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def setUp(self):
+    StubCoinDesk.rate = 400.0
+    StubCoinDesk.hits = 0
+    StubCoinDesk.fail = False
+
+  def test_serves_from_cache(self):
+    feed = PriceFeed(self.source, interval=60, max_staleness=60)
+    self.assertIsNone(feed.age())
+    self.assertEqual(feed.get(), 400.0)
+    StubCoinDesk.rate = 500.0
+    for _ in range(10):
+      self.assertEqual(feed.get(), 400.0)
+    self.assertEqual(StubCoinDesk.hits, 1)
+    self.assertLess(feed.age(), 60)
+
+  def test_max_staleness(self):
+    feed = PriceFeed(self.source, interval=60, max_staleness=0.05)
+    self.assertEqual(feed.get(), 400.0)
+    StubCoinDesk.rate = 500.0
+    time.sleep(0.1)
+    self.assertEqual(feed.get(), 500.0)
+    StubCoinDesk.fail = True
+    time.sleep(0.1)
+    self.assertRaises(StalePrice, feed.get)
+
+  def test_background_refresh(self):
+    feed = PriceFeed(self.source, interval=0.02, max_staleness=60)
+    feed.start()
+    try:
+      StubCoinDesk.rate = 500.0
+      deadline = time.time() + 2
+      while feed.rate != 500.0 and time.time() < deadline:
+        time.sleep(0.01)
+      self.assertEqual(feed.get(), 500.0)
+    finally:
+      feed.stop()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,60 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import unittest
+from price_lock import *
+
+class TestPriceLock(unittest.TestCase):
+
+  def setUp(self):
+    self.locks = PriceLock(b'secret', ttl=30)
+    self.token = self.locks.issue(True, 5171, 400.25, now=1000)
+
+  def test_round_trip(self):
+    self.assertEqual(self.locks.verify(self.token, True, now=1010), (5171, 400.25))
+
+  def test_expired(self):
+    self.assertRaises(LockInvalid, self.locks.verify, self.token, True, now=1031)
+    # paid for just before expiry
+    self.assertEqual(self.locks.redeem(self.token, True, now=1031), 5171)
+    token = self.locks.issue(True, 5171, 400.25, now=1000)
+    self.assertRaises(LockInvalid, self.locks.redeem, token, True, now=1061)
+
+  def test_replay(self):
+    self.assertEqual(self.locks.redeem(self.token, True, now=1010), 5171)
+    self.assertRaises(LockInvalid, self.locks.redeem, self.token, True, now=1011)
+    self.assertRaises(LockInvalid, self.locks.verify, self.token, True, now=1011)
+    # each lock is its own
+    other = self.locks.issue(True, 5171, 400.25, now=1000)
+    self.assertNotEqual(other, self.token)
+    self.assertEqual(self.locks.redeem(other, True, now=1012), 5171)
+    # used nonces are forgotten once redeem would refuse their locks anyway
+    self.locks.redeem(self.locks.issue(True, 1, 400.25, now=2000), True, now=2010)
+    self.assertEqual(len(self.locks.used), 1)
+    self.assertRaises(LockInvalid, self.locks.redeem, self.token, True, now=2010)
+
+  def test_rate_move(self):
+    self.assertEqual(self.locks.verify(self.token, True, now=1010, usd_rate=401.0), (5171, 400.25))
+    self.assertRaises(LockInvalid, self.locks.verify, self.token, True, now=1010, usd_rate=405.0)
+    # a refused lock is not used up
+    self.assertEqual(self.locks.redeem(self.token, True, now=1010), 5171)
+
+  def test_tampered(self):
+    forged = self.token.replace(':5171:', ':1:')
+    self.assertRaises(LockInvalid, self.locks.verify, forged, True, now=1010)
+    self.assertRaises(LockInvalid, PriceLock(b'other').verify, self.token, True, now=1010)
+    self.assertRaises(LockInvalid, self.locks.verify, self.token, False, now=1010)
+
+  def test_quantity(self):
+    token = self.locks.issue(False, 250000, 400.25, now=1000, quantity=50)
+    self.assertEqual(self.locks.verify(token, False, now=1010, quantity=50), (250000, 400.25))
+    self.assertRaises(LockInvalid, self.locks.verify, token, False, now=1010)
+
+  def test_malformed(self):
+    for token in [None, '', 'abc', '1:2:3:4:5', 'a:b:c:d:e:f']:
+      self.assertRaises(LockInvalid, self.locks.verify, token, True, now=1010)
+      self.assertRaises(LockInvalid, self.locks.locked_price, token)
+    self.assertEqual(self.locks.locked_price(self.token), 5171)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,48 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import unittest
+from price_oracle import *
+from price_feed import PriceFeed
+
+class FakeSource(object):
+  def __init__(self, rate, delay=0, fail=False):
+    self.rate = rate
+    self.delay = delay
+    self.fail = fail
+
+  def fetch(self):
+    time.sleep(self.delay)
+    if self.fail:
+      raise PriceUnavailable("fake")
+    return self.rate
+
+class TestPriceOracle(unittest.TestCase):
+
+  def test_median(self):
+    oracle = PriceOracle([FakeSource(400), FakeSource(410), FakeSource(9000)])
+    self.assertEqual(oracle.fetch(), 410)
+
+  def test_deadline(self):
+    oracle = PriceOracle([FakeSource(400), FakeSource(420), FakeSource(1, delay=1)], deadline=0.1)
+    start = time.time()
+    self.assertEqual(oracle.fetch(), 410)
+    self.assertLess(time.time() - start, 0.5)
+
+  def test_failed_sources(self):
+    oracle = PriceOracle([FakeSource(400), FakeSource(1, fail=True)])
+    self.assertEqual(oracle.fetch(), 400)
+    oracle = PriceOracle([FakeSource(400, fail=True)])
+    self.assertRaises(PriceUnavailable, oracle.fetch)
+
+  def test_feed_falls_back_to_last_good(self):
+    source = FakeSource(400)
+    feed = PriceFeed(PriceOracle([source]), interval=60, max_staleness=60)
+    self.assertEqual(feed.get(), 400)
+    source.fail = True
+    self.assertRaises(PriceUnavailable, feed.refresh)
+    self.assertEqual(feed.get(), 400)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,55 @@
+""" Book states priced per second: scalar calc_cost vs the batch API,
+    then a stress run over books of 10^3 to 10^7 outstanding options
+
+    python3 test/price_rules_bench.py [states]
+"""
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import numpy as np
+
+from price_rules import calc_cost, calc_cost_batch, cost_function_batch, CostTable
+
+def rate(n, fn):
+    start = time.perf_counter()
+    fn()
+    return n / (time.perf_counter() - start)
+
+def main(n):
+    rng = np.random.default_rng(0)
+    buys = rng.integers(0, 500, n)
+    sells = rng.integers(0, 500, n)
+    sides = rng.integers(0, 2, n).astype(bool)
+    table = CostTable()
+
+    scalar_n = min(n, 200000)
+    b, s, side = buys[:scalar_n].tolist(), sells[:scalar_n].tolist(), sides[:scalar_n].tolist()
+    print("%-12s %14.0f states/s" % ("scalar", rate(scalar_n,
+        lambda: [calc_cost(*x) for x in zip(b, s, side)])))
+    print("%-12s %14.0f states/s" % ("batch", rate(n,
+        lambda: calc_cost_batch(buys, sells, sides))))
+    print("%-12s %14.0f states/s" % ("table", rate(n,
+        lambda: table.cost_batch(buys, sells, sides))))
+
+def stress(n):
+    rng = np.random.default_rng(0)
+    print("%10s %14s %10s %10s %14s" % ("options", "states/s", "min buy", "max buy", "max C"))
+    for exp in range(3, 8):
+        outstanding = 10**exp
+        buys = rng.integers(0, outstanding, n)
+        sells = outstanding - buys
+        start = time.perf_counter()
+        costs = calc_cost_batch(buys, sells, True)
+        c = cost_function_batch(buys, sells)
+        elapsed = time.perf_counter() - start
+        assert np.isfinite(costs).all() and np.isfinite(c).all()
+        calc_cost(outstanding, 0, True)
+        calc_cost(0, outstanding, False)
+        print("%10d %14.0f %10.5f %10.5f %14.1f" % (outstanding, n / elapsed,
+            costs.min(), costs.max(), c.max()))
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    main(n)
+    stress(n)
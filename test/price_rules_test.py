@@ -1,6 +1,7 @@
 import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import math
 import unittest
 from price_rules import *
 
@@ -38,5 +39,84 @@ class TestPriceRules(unittest.TestCase):
       self.assertGreater(revenue - buys, -10)
       self.assertGreater(revenue - sells, -10)
 
+class TestMultiUnitPricing(unittest.TestCase):
+
+  def test_one_unit(self):
+    for _ in range(100):
+      buys = randint(0,100)
+      sells = randint(0,100)
+      self.assertEqual(calc_cost_many(buys, sells, 1, True), calc_cost(buys+1, sells, True))
+      self.assertEqual(calc_cost_many(buys, sells, 1, False), calc_cost(buys, sells+1, False))
+
+  def test_split_orders(self):
+    for _ in range(100):
+      buys = randint(0,100)
+      sells = randint(0,100)
+      n = randint(2,50)
+      total = calc_cost_many(buys, sells, n, True)
+      # above n at the price before the order, the same as n bought one at a time
+      before = (1 + DEFAULT_SPREAD) * price_function(buys, buys, sells) * RANGE + DEFAULT_MIN
+      one_at_a_time = sum(calc_cost_many(buys+k, sells, 1, True) for k in range(n))
+      self.assertGreater(total, n * before)
+      self.assertAlmostEqual(total, one_at_a_time)
+      # buying n then m costs the same as buying n+m at once
+      m = randint(2,50)
+      self.assertAlmostEqual(calc_cost_many(buys, sells, n, False) + calc_cost_many(buys, sells+n, m, False),
+                             calc_cost_many(buys, sells, n+m, False))
+
+class TestStablePricing(unittest.TestCase):
+
+  def test_matches_direct_form(self):
+    for buys in range(0, 1000, 7):
+      for sells in range(0, 1000, 11):
+        direct = math.exp(buys/B_FACTOR) / (math.exp(buys/B_FACTOR) + math.exp(sells/B_FACTOR))
+        self.assertAlmostEqual(price_function(buys, buys, sells), direct, places=12)
+        direct = B_FACTOR * math.log(math.exp(buys/B_FACTOR) + math.exp(sells/B_FACTOR))
+        self.assertAlmostEqual(cost_function(buys, sells), direct, places=9)
+
+  def test_large_books(self):
+    for n in [10**4, 10**5, 10**7]:
+      self.assertAlmostEqual(calc_cost(n+1, n, True), calc_cost(1, 0, True))
+      self.assertAlmostEqual(calc_cost(n, n+1, False), calc_cost(0, 1, False))
+      self.assertAlmostEqual(price_function(n, n, 0), 1.0)
+      self.assertAlmostEqual(cost_function(n, n), n + B_FACTOR * math.log(2))
+    prices = price_function_batch([10**7, 0], [10**7, 10**7], [0, 0])
+    self.assertAlmostEqual(prices[0], 1.0)
+    self.assertAlmostEqual(prices[1], 0.0)
+    self.assertAlmostEqual(cost_function_batch(10**7, 10**7), 10**7 + B_FACTOR * math.log(2))
+
+class TestBatchPricing(unittest.TestCase):
+
+  def setUp(self):
+    self.buys = [randint(0,1000) for _ in range(1000)]
+    self.sells = [randint(0,1000) for _ in range(1000)]
+    self.sides = [randint(0,1) == 1 for _ in range(1000)]
+
+  def test_price_function_batch(self):
+    prices = price_function_batch(self.buys, self.buys, self.sells)
+    for b, s, p in zip(self.buys, self.sells, prices):
+      self.assertAlmostEqual(p, price_function(b, b, s))
+
+  def test_calc_cost_batch(self):
+    costs = calc_cost_batch(self.buys, self.sells, self.sides)
+    for b, s, side, c in zip(self.buys, self.sells, self.sides, costs):
+      self.assertAlmostEqual(c, calc_cost(b, s, side))
+
+  def test_cost_table(self):
+    table = CostTable(size=600)
+    costs = table.cost_batch(self.buys, self.sells, self.sides)
+    for b, s, side, c in zip(self.buys, self.sells, self.sides, costs):
+      self.assertAlmostEqual(c, calc_cost(b, s, side))
+      self.assertAlmostEqual(table.cost(b, s, side), calc_cost(b, s, side))
+
+  def test_cost_table_fractional(self):
+    # time-weighted book states are fractional; they are not in the table
+    table = CostTable(size=8)
+    self.assertAlmostEqual(table.cost(1.5, 2), calc_cost(1.5, 2))
+    self.assertAlmostEqual(table.cost(2.0, 3.0, False), calc_cost(2, 3, False))
+    costs = table.cost_batch([1.9, 1, 0.25, 9], [0.0, 2, 7.5, 1], [True, False, True, True])
+    for b, s, side, c in zip([1.9, 1, 0.25, 9], [0.0, 2, 7.5, 1], [True, False, True, True], costs):
+      self.assertAlmostEqual(c, calc_cost(b, s, side))
+
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
@@ -0,0 +1,41 @@
+""" n options as one multi-unit order (one pricing, one transaction) vs
+    n single-option orders, through add_to_book with fsync'd commits
+
+    python3 test/quantity_bench.py [repeats]
+"""
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tempfile
+import time
+
+import db
+from orderbook import add_to_book, live_book
+
+PAYMENT = 10000
+
+def run(database, n, quantity, repeats):
+    conn = db.connect(database)
+    conn.execute("PRAGMA synchronous=FULL")
+    db.migrate(conn)
+    live_book.load(conn)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for _ in range(n // quantity):
+            add_to_book(conn, "blah", PAYMENT, 400, True, quantity=quantity)
+    elapsed = time.perf_counter() - start
+    paid = conn.execute("SELECT sum(price) FROM orders").fetchone()[0]
+    conn.close()
+    return elapsed / repeats * 1000, paid / repeats
+
+def main(repeats):
+    print("%6s %8s %12s %14s" % ("n", "mode", "ms per n", "paid per n"))
+    for n in [1, 10, 50, 100]:
+        for mode, quantity in [("n x 1", 1), ("1 x n", n)]:
+            with tempfile.TemporaryDirectory() as tmp:
+                result = run(os.path.join(tmp, "bench.db"), n, quantity,
+                             repeats)
+            print("%6d %8s %12.2f %14.0f" % ((n, mode) + result))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
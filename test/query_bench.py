@@ -0,0 +1,44 @@
+""" Per-quote cost of the strike-filtered book query: SQL text formatted
+    per call (a new statement every time) vs the parameterized statement
+    served from the connection's statement cache
+
+    python3 test/query_bench.py [calls]
+"""
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import timeit
+from random import randint, uniform
+
+import db
+from orderbook import SELECT_STRIKE_BOOK
+
+FORMATTED = "SELECT is_buy, payout_address, usd_rate, price, created_at \
+                    FROM orders \
+                    WHERE (is_buy = 0 AND usd_rate <= %.5f) OR \
+                    (is_buy = 1 AND usd_rate >= %.5f) \
+                    ORDER BY created_at"
+
+def main(n):
+    conn = sqlite3.connect(':memory:', cached_statements=db.STATEMENT_CACHE)
+    db.migrate(conn)
+    # a small book, so preparing the statement dominates
+    conn.executemany("INSERT INTO orders(is_buy, payout_address, usd_rate, price) \
+        VALUES (?, 'blah', ?, 999)", [(randint(0, 1), uniform(300, 500)) for _ in range(10)])
+    rates = [uniform(300, 500) for _ in range(n)]
+
+    def formatted():
+        for r in rates:
+            conn.execute(FORMATTED % (r, r)).fetchall()
+
+    def parameterized():
+        for r in rates:
+            conn.execute(SELECT_STRIKE_BOOK, {"usd_rate": r}).fetchall()
+
+    for name, fn in [("formatted", formatted), ("parameterized", parameterized)]:
+        best = min(timeit.repeat(fn, number=1, repeat=5))
+        print("%-14s %8.2f us/query" % (name, best / n * 1e6))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
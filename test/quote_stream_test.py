@@ -0,0 +1,81 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import threading
+import time
+import unittest
+from datetime import datetime
+from orderbook import LiveBook, Order
+from price_oracle import PriceUnavailable
+from quote_stream import *
+
+def parse(event):
+  lines = dict(line.split(': ', 1) for line in event.decode('utf-8').strip().split('\n'))
+  return int(lines['id']), json.loads(lines['data'])
+
+class TestQuoteBroadcaster(unittest.TestCase):
+
+  def setUp(self):
+    self.rate = 400.0
+    self.book = LiveBook()
+    self.book.loaded = True
+    # an hour's tick, so only the tests' own changes publish
+    self.broadcaster = QuoteBroadcaster(lambda: self.rate, self.book, poll=0.02, keepalive=0.05, tick=3600)
+
+  def tearDown(self):
+    self.broadcaster.stop()
+
+  def test_publishes_on_change_only(self):
+    now = 1000.0
+    self.assertTrue(self.broadcaster.refresh(now))
+    self.assertFalse(self.broadcaster.refresh(now + 0.5))
+    self.rate = 401.0
+    self.assertTrue(self.broadcaster.refresh(now + 0.5))
+    self.book.add(Order(True, "blah", 400, 999, datetime.utcnow()))
+    self.assertTrue(self.broadcaster.refresh(now + 0.5))
+    seq, quote = parse(self.broadcaster.latest()[1])
+    self.assertEqual(seq, 3)
+    self.assertEqual(quote["usd_rate"], 401.0)
+    self.assertGreater(quote["buy"], quote["sell"])
+
+  def test_time_decay(self):
+    self.book.add(Order(True, "blah", 400, 999, datetime.utcnow()))
+    now = time.time()
+    self.assertTrue(self.broadcaster.refresh(now))
+    first = parse(self.broadcaster.latest()[1])[1]
+    # nothing traded and BTCUSD held, but the buy has an hour less to run
+    self.assertTrue(self.broadcaster.refresh(now + 3600))
+    later = parse(self.broadcaster.latest()[1])[1]
+    self.assertLess(later["buy"], first["buy"])
+
+  def test_price_unavailable(self):
+    def fail():
+      raise PriceUnavailable("down")
+    self.broadcaster.get_rate = fail
+    self.assertFalse(self.broadcaster.refresh())
+    self.assertEqual(self.broadcaster.latest(), (0, None))
+
+  def test_fan_out(self):
+    received = [[] for _ in range(20)]
+    def listen(events):
+      for event in self.broadcaster.subscribe():
+        if event != KEEPALIVE_EVENT:
+          events.append(parse(event)[0])
+    threads = [threading.Thread(target=listen, args=(r,)) for r in received]
+    for t in threads:
+      t.start()
+    self.broadcaster.start()
+    time.sleep(0.1)
+    self.book.add(Order(True, "blah", 400, 999, datetime.utcnow()))
+    time.sleep(0.1)
+    self.broadcaster.stop()
+    for t in threads:
+      t.join()
+    # one computation per change, seen by every subscriber
+    self.assertEqual(self.broadcaster.seq, 2)
+    for events in received:
+      self.assertEqual(events, [1, 2])
+
+if __name__ == '__main__':
+  unittest.main()
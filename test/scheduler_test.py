@@ -0,0 +1,70 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import threading
+import time
+import unittest
+import db
+from scheduler import *
+
+class TestExpiryScheduler(unittest.TestCase):
+
+  def setUp(self):
+    self.settled = []
+    self.event = threading.Event()
+    self.scheduler = ExpiryScheduler(self.settle, window=0.1, retry=0.01)
+
+  def tearDown(self):
+    self.scheduler.stop()
+
+  def settle(self, until):
+    self.settled.append((until, time.time()))
+    self.event.set()
+
+  def wait_settled(self, n):
+    deadline = time.time() + 2
+    while len(self.settled) < n and time.time() < deadline:
+      self.event.wait(0.05)
+      self.event.clear()
+
+  def test_coalesces_window(self):
+    now = time.time()
+    self.scheduler.start()
+    for delay in [0.05, 0.1, 0.12, 0.5]:
+      self.scheduler.add(now + delay)
+    self.wait_settled(2)
+    self.assertEqual([u for u, _ in self.settled], [now + 0.12, now + 0.5])
+    for until, at in self.settled:
+      self.assertGreaterEqual(at, until)
+    self.assertIsNone(self.scheduler.next_expiry())
+
+  def test_load(self):
+    conn = sqlite3.connect(':memory:')
+    db.migrate(conn)
+    conn.execute("INSERT INTO orders(created_at, is_buy, payout_address, usd_rate, price) \
+      VALUES (datetime('now', '-1 day', '-10 seconds'), 1, 'blah', 400, 999)")
+    conn.execute("INSERT INTO orders(created_at, is_buy, payout_address, usd_rate, price) \
+      VALUES (datetime('now'), 0, 'blah', 400, 999)")
+    self.scheduler.load(conn)
+    self.scheduler.start()
+    self.wait_settled(1)
+    self.assertEqual(len(self.settled), 1)
+    self.assertGreater(self.scheduler.next_expiry(), time.time() + EXPIRY_SECONDS - 10)
+
+  def test_retry(self):
+    calls = []
+    def settle(until):
+      calls.append(until)
+      if len(calls) == 1:
+        raise ValueError("wallet down")
+      self.settle(until)
+    self.scheduler.settle = settle
+    self.scheduler.add(time.time())
+    self.scheduler.start()
+    self.wait_settled(1)
+    self.assertEqual(len(calls), 2)
+    self.assertEqual(calls[0], calls[1])
+
+if __name__ == '__main__':
+  unittest.main()
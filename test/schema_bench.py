@@ -0,0 +1,69 @@
+""" Quote-path latency against a book with a long expired history
+
+    python3 test/schema_bench.py [rows ...]
+
+Runs the book queries on the legacy schema (expired rows kept in orders
+with is_buy = -1, no indexes) and again after db.migrate.
+"""
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import tempfile
+import timeit
+from random import randint, uniform
+
+import db
+from orderbook import LiveBook, get_order_book
+from payout import get_oldest
+
+LEGACY_SCHEMA = """CREATE TABLE orders (
+    id                  INTEGER PRIMARY KEY,
+    created_at          DATETIME DEFAULT CURRENT_TIMESTAMP,
+    is_buy              INTEGER NOT NULL,
+    payout_address      TEXT NOT NULL,
+    usd_rate            REAL NOT NULL,
+    price               INTEGER NOT NULL
+);"""
+
+LIVE_ORDERS = 1000
+REPEAT = 20
+
+def fill(conn, historical):
+    rows = ((-1, "blah", uniform(300, 500), randint(1, 10000))
+                for _ in range(historical))
+    conn.executemany("INSERT INTO orders(is_buy, payout_address, usd_rate, price) \
+        VALUES (?, ?, ?, ?)", rows)
+    rows = ((randint(0, 1), "blah", uniform(300, 500), randint(1, 10000))
+                for _ in range(LIVE_ORDERS))
+    conn.executemany("INSERT INTO orders(is_buy, payout_address, usd_rate, price) \
+        VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+
+def timed(fn):
+    return min(timeit.repeat(fn, number=1, repeat=REPEAT)) * 1000
+
+def run(conn):
+    return (timed(lambda: get_order_book(conn, 400.0).get_quote(True)),
+            timed(lambda: get_order_book(conn).get_quote(True)),
+            timed(lambda: get_oldest(conn)),
+            timed(lambda: LiveBook().load(conn)))
+
+def main(sizes):
+    print("%10s %8s %12s %12s %12s %12s" % ("rows", "schema",
+        "strike (ms)", "book (ms)", "oldest (ms)", "load (ms)"))
+    for historical in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+            conn.executescript(LEGACY_SCHEMA)
+            fill(conn, historical)
+            print("%10d %8s %12.3f %12.3f %12.3f %12.3f" %
+                    ((historical, "legacy") + run(conn)))
+            db.migrate(conn)
+            print("%10d %8s %12.3f %12.3f %12.3f %12.3f" %
+                    ((historical, "migrated") + run(conn)))
+            conn.close()
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [10000, 100000, 1000000]
+    main(sizes)
@@ -0,0 +1,64 @@
+""" Load test one route on running servers, e.g. the Flask server_dev.py
+    on :5000 against server_async.py on :5001, at rising concurrency;
+    shows where each stops scaling (throughput flat, p99 climbing)
+
+    python3 test/server_bench.py <route> <base url> [<base url> ...]
+    python3 test/server_bench.py /quote http://localhost:5000 http://localhost:5001
+"""
+import sys
+import threading
+import time
+
+import requests
+
+CONCURRENCY = [1, 8, 32, 128]
+DURATION = 5.0  # seconds per run
+
+def percentile(latencies, p):
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))]
+
+def run(url, clients, duration=DURATION):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    def worker():
+        session = requests.Session()
+        mine = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                r = session.get(url, timeout=30)
+                r.content
+                if r.status_code >= 400:
+                    failed += 1
+            except requests.RequestException:
+                failed += 1
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+    workers = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return (len(latencies) / elapsed, percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000, errors[0])
+
+def main(route, bases):
+    print("%-28s %8s %10s %10s %10s %8s" % ("server", "clients", "req/s", "p50 ms", "p99 ms", "errors"))
+    for clients in CONCURRENCY:
+        for base in bases:
+            result = run(base.rstrip('/') + route, clients)
+            print("%-28s %8d %10.0f %10.2f %10.2f %8d" % ((base, clients) + result))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2:])
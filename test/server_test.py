@@ -0,0 +1,89 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import mock
+import sqlite3
+import tempfile
+import unittest
+
+class TestBuy(unittest.TestCase):
+  """ server.py offline: stand-in wallet, payments and BTCUSD
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    os.environ['VENDING_OFFLINE'] = '1'
+    cls.cwd = os.getcwd()
+    cls.tmp = tempfile.TemporaryDirectory()
+    os.chdir(cls.tmp.name)  # server.py opens book.db in the cwd
+    import server
+    cls.server = server
+    cls.client = server.app.test_client()
+
+  @classmethod
+  def tearDownClass(cls):
+    from orderbook import live_book
+    cls.server.app.extensions['vending_machine']()
+    del live_book.listeners[:]
+    live_book.loaded = False
+    live_book._reset()
+    os.chdir(cls.cwd)
+    cls.tmp.cleanup()
+
+  def lock(self, action='up'):
+    return json.loads(self.client.get('/quote/lock?action=%s' % action).data)
+
+  def buy(self, address, lock, action='up'):
+    return self.client.get('/buy?action=%s&payout_address=%s&lock=%s' % (action, address, lock))
+
+  def charged(self):
+    return self.server.payment.charged
+
+  def query(self, sql, *args):
+    conn = sqlite3.connect('book.db')
+    try:
+      return conn.execute(sql, args).fetchall()
+    finally:
+      conn.close()
+
+  def test_back_to_back_locks(self):
+    first, second = self.lock(), self.lock()
+    self.assertEqual(first['price'], second['price'])
+    charged = self.charged()
+    # the first fill moves the book; the second lock is still honoured
+    for lock in [first, second]:
+      r = self.buy('twice', lock['lock'])
+      self.assertEqual(r.status_code, 200)
+      self.assertTrue(r.data.startswith(b'Paid %d for 1.' % lock['price']))
+    self.assertEqual(self.charged() - charged, first['price'] + second['price'])
+    prices = self.query("SELECT price FROM orders WHERE payout_address = 'twice'")
+    self.assertEqual(prices, [(first['price'],), (second['price'],)])
+
+  def test_replay(self):
+    lock = self.lock('down')['lock']
+    self.assertEqual(self.buy('replay', lock, 'down').status_code, 200)
+    charged = self.charged()
+    r = self.buy('replay', lock, 'down')
+    self.assertEqual(r.status_code, 400)
+    # refused before payment
+    self.assertEqual(self.charged(), charged)
+    self.assertEqual(len(self.query("SELECT id FROM orders WHERE payout_address = 'replay'")), 1)
+
+  def test_paid_then_refused(self):
+    lock = self.lock()
+    self.assertEqual(self.buy('first', lock['lock']).status_code, 200)
+    # a second payment for the lock that got past the check before the
+    # first one redeemed it
+    verify = mock.Mock(return_value=(lock['price'], lock['usd_rate']))
+    charged = self.charged()
+    with mock.patch.object(self.server.machine_app.price_lock, 'verify', verify):
+      r = self.buy('second', lock['lock'])
+    self.assertEqual(r.status_code, 409)
+    self.assertEqual(self.charged() - charged, lock['price'])
+    self.assertEqual(self.query("SELECT id FROM orders WHERE payout_address = 'second'"), [])
+    self.assertEqual(self.query("SELECT amount FROM balances WHERE payout_address = 'second'"),
+                     [(lock['price'],)])
+
+if __name__ == '__main__':
+  unittest.main()
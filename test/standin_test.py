@@ -0,0 +1,51 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+import time
+import unittest
+import db
+from flask import Flask
+from standin import *
+from payout import claim_expired, pay_claimed
+
+class TestStandins(unittest.TestCase):
+
+  def test_wallet(self):
+    wallet = Wallet()
+    conn = sqlite3.connect(':memory:')
+    db.migrate(conn)
+    conn.executemany("INSERT INTO orders(created_at, is_buy, payout_address, usd_rate, price) \
+      VALUES (datetime('now', '-2 days'), 1, ?, 400, 999)", [("addr%d" % i,) for i in range(5)])
+    claim_expired(conn, int(time.time()), 450)
+    txids = pay_claimed(conn, wallet, 450, 1000, max_outputs=2)
+    self.assertEqual(len(set(txids)), 3)
+    self.assertEqual([txid for txid, _ in wallet.sent], txids)
+    self.assertEqual(conn.execute("SELECT count(*) FROM payouts WHERE txid IS NOT NULL").fetchone()[0], 3)
+
+  def test_payment(self):
+    app = Flask(__name__)
+    payment = Payment(app, Wallet())
+
+    @app.route('/fixed')
+    @payment.required(1000)
+    def fixed():
+      return 'ok'
+
+    @app.route('/priced')
+    @payment.required(lambda *args: 250)
+    def priced():
+      return 'ok'
+
+    client = app.test_client()
+    self.assertEqual(client.get('/fixed').data, b'ok')
+    self.assertEqual(client.get('/priced').data, b'ok')
+    self.assertEqual((payment.payments, payment.charged), (2, 1250))
+
+  def test_price(self):
+    self.assertEqual(StaticPriceSource(400.0).fetch(), 400.0)
+    for _ in range(100):
+      self.assertAlmostEqual(StaticPriceSource(400.0, 1.0).fetch(), 400.0, delta=1.0)
+
+if __name__ == '__main__':
+  unittest.main()